@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+
+from caches import LRUCache
+from storage import dump_json, read_json, write_file_atomic
+
+
+# Слова на любом языке: в отличие от поиска, ключ не должен терять буквы вне кириллицы и латиницы
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize_question(question):
+    """Ключ вопроса: NFKC, casefold, ё -> е, без пунктуации; у вопроса без букв и цифр ключ пустой."""
+    text = unicodedata.normalize("NFKC", question or "").casefold().replace("ё", "е")
+    return " ".join(WORD_RE.findall(text))
+
+
+class AnswerCache:
+    """Кэш ответов AI по нормализованному вопросу и версии каталога мероприятий."""
+
+    def __init__(self, maxsize=512, ttl=6 * 3600, cache_file=None):
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self.cache = LRUCache(maxsize)
+        self.expired = 0
+        self.coalesced = 0
+        self._pending = {}
+
+    def _key(self, question, catalog_version):
+        # После изменения каталога старые ответы перестают находиться и вытесняются LRU
+        return normalize_question(question), catalog_version
+
+    def get(self, question, catalog_version):
+        key = self._key(question, catalog_version)
+        if not key[0]:
+            return None
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        created, answer = entry
+        # Ответ старше ttl устарел, даже если каталог не менялся
+        if time.time() - created > self.ttl:
+            self.cache.pop(key)
+            self.expired += 1
+            return None
+        return answer
+
+    def put(self, question, catalog_version, answer, created=None):
+        key = self._key(question, catalog_version)
+        if key[0]:
+            self.cache.put(key, (created or time.time(), answer))
+
+    async def get_or_ask(self, question, catalog_version, ask):
+        """Ответ из кэша или от async ask(question); ask возвращает None, если ответа нет."""
+        key = self._key(question, catalog_version)
+        if not key[0]:
+            return await ask(question)
+        answer = self.get(question, catalog_version)
+        if answer is not None:
+            return answer
+        # Одновременные одинаковые вопросы ждут один запрос к AI
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._ask(question, catalog_version, ask))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: если спросивший уйдёт, запрос всё равно завершится для остальных ждущих
+        return await asyncio.shield(task)
+
+    async def _ask(self, question, catalog_version, ask):
+        answer = await ask(question)
+        if answer is not None:
+            self.put(question, catalog_version, answer)
+        return answer
+
+    async def load(self, catalog_fingerprint, catalog_version):
+        if not self.cache_file:
+            return
+        # Версия каталога после перезапуска начинается заново, поэтому сохранённые ответы
+        # годятся, только если отпечаток каталога не изменился
+        saved = await asyncio.to_thread(read_json, self.cache_file, {})
+        if saved.get("catalog") != catalog_fingerprint:
+            if saved:
+                logging.info("Каталог мероприятий изменился, сохранённые ответы AI не загружаются")
+            return
+        now = time.time()
+        for question, created, answer in saved.get("answers", []):
+            if now - created <= self.ttl:
+                self.put(question, catalog_version, answer, created)
+        logging.info(f"Загружено сохранённых ответов AI: {len(self.cache)}")
+
+    async def save(self, catalog_fingerprint, catalog_version):
+        if not self.cache_file:
+            return
+        # LRUCache хранит записи от давних к свежим — так же они и загрузятся
+        answers = [[question, created, answer]
+                   for (question, version), (created, answer) in self.cache.items()
+                   if version == catalog_version]
+        payload = dump_json({"catalog": catalog_fingerprint, "answers": answers})
+        await asyncio.to_thread(write_file_atomic, self.cache_file, payload)
+
+    def stats(self):
+        return {**self.cache.stats(), "expired": self.expired, "coalesced": self.coalesced}
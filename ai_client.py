@@ -0,0 +1,76 @@
+import json
+import logging
+
+import aiohttp
+
+
+class AIResponseError(Exception):
+    """AI API ответил не 200."""
+
+    def __init__(self, status):
+        super().__init__(f"AI API ответил {status}")
+        self.status = status
+
+
+def response_content(payload):
+    """Текст из ответа в формате chat completions: целиком (message) или порция потока (delta)."""
+    choice = (payload.get("choices") or [{}])[0]
+    return (choice.get("delta") or choice.get("message") or {}).get("content") or ""
+
+
+class AIClient:
+    """HTTP клиент AI API с общим пулом keep-alive соединений (не больше pool_size)."""
+
+    def __init__(self, url, headers, pool_size=10, connect_timeout=10.0, read_timeout=30.0):
+        self.url = url
+        self.headers = headers
+        self.pool_size = pool_size
+        # read_timeout ограничивает паузу между порциями ответа, а не весь ответ
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+
+    def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=self.timeout)
+
+    @staticmethod
+    def _body(data):
+        # UTF-8 вместо \uXXXX: кириллица в подсказке занимает в запросе втрое меньше
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    async def post_json(self, data):
+        """Отправляет data в AI API; возвращает (статус, разобранный JSON или None)."""
+        async with self.session.post(self.url, data=self._body(data)) as response:
+            if response.status != 200:
+                return response.status, None
+            # Сервер не всегда ставит content-type application/json
+            return response.status, await response.json(content_type=None)
+
+    async def stream(self, data):
+        """Отдаёт порции текста ответа по мере прихода; на статус, отличный от 200, — AIResponseError."""
+        async with self.session.post(self.url, data=self._body(data)) as response:
+            if response.status != 200:
+                raise AIResponseError(response.status)
+            # Сервер ответил обычным JSON вместо потока — весь текст одной порцией
+            if response.content_type != "text/event-stream":
+                content = response_content(await response.json(content_type=None))
+                if content:
+                    yield content
+                return
+            # Server-sent events: "data: {...}" с delta.content, в конце "data: [DONE]"
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                chunk = line[len(b"data:"):].strip()
+                if chunk == b"[DONE]":
+                    return
+                content = response_content(json.loads(chunk))
+                if content:
+                    yield content
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            logging.info("Сессия AI API закрыта")
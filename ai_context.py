@@ -0,0 +1,45 @@
+import math
+
+# Грубая оценка: в русском тексте токен модели — в среднем около трёх символов
+CHARS_PER_TOKEN = 3
+# Длиннее описание в подсказку не попадает, чтобы одно мероприятие не съело весь бюджет
+MAX_DESCRIPTION_CHARS = 300
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def format_event_for_ai(event):
+    description = (event.get("description") or "Без описания").strip()
+    if len(description) > MAX_DESCRIPTION_CHARS:
+        description = description[:MAX_DESCRIPTION_CHARS].rstrip() + "…"
+    lines = [f"Название: {event.get('name', 'Без названия')}"]
+    if event.get("time"):
+        lines.append(f"Когда: {event['time']}")
+    if event.get("location"):
+        lines.append(f"Где: {event['location']}")
+    lines.append(f"Описание: {description}")
+    return "\n".join(lines)
+
+
+def build_event_context(relevant, upcoming, token_budget):
+    """Текст о мероприятиях для подсказки AI не длиннее token_budget токенов.
+
+    relevant — [(id, мероприятие)] по убыванию релевантности вопросу, upcoming — ближайшие
+    по дате. Сначала идут релевантные, затем ближайшие, которых среди них нет; мероприятие,
+    не помещающееся в бюджет, пропускается, а следующие (возможно, короче) ещё пробуются.
+    """
+    blocks, used, seen = [], 0, set()
+    separator_tokens = estimate_tokens("\n---\n")
+    for event_id, event in [*relevant, *upcoming]:
+        if event is None or event_id in seen:
+            continue
+        seen.add(event_id)
+        block = format_event_for_ai(event)
+        cost = estimate_tokens(block) + (separator_tokens if blocks else 0)
+        if used + cost > token_budget:
+            continue
+        blocks.append(block)
+        used += cost
+    return "\n---\n".join(blocks)
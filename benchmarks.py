@@ -0,0 +1,338 @@
+"""Замеры производительности хранилища бота.
+
+    python benchmarks.py save_user                       # 1k, 100k и 1M пользователей
+    python benchmarks.py save_user --sizes 1000 100000 --shards 1 16 64
+    python benchmarks.py search                          # 1k, 10k и 100k мероприятий
+    python benchmarks.py callbacks                       # разбор нажатий на inline кнопки
+    python benchmarks.py ai_context                      # подсказка AI при 100, 1k и 10k мероприятий
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from aiohttp import web
+
+from ai_client import AIClient
+from ai_context import build_event_context, estimate_tokens
+from callback_router import CallbackRouter
+from search import SearchIndex, event_document
+from storage import (SqliteBackend, create_backend, dump_json, event_sort_date, write_file_atomic,
+                     write_user_shards)
+
+FIRST_USER_ID = 100_000_000
+
+EVENT_WORDS = [
+    "вечеринка", "настольные", "игры", "лекция", "кино", "музей", "выставка", "поход", "лес", "озеро",
+    "квиз", "караоке", "концерт", "театр", "экскурсия", "знакомство", "студенты", "факультет", "встреча",
+    "турнир", "шахматы", "мафия", "пикник", "волейбол", "йога", "танцы", "хакатон", "python", "дизайн",
+    "фотография", "рисование", "книги", "клуб", "кофе", "завтрак", "ночь", "субботник", "баня", "велопрогулка",
+    "каток", "лыжи", "галерея", "искусство", "история", "наука", "робототехника", "стартап", "карьера",
+]
+SEARCH_QUERIES = ["настольные игры", "концерт", "поход на озеро", "настол", "музей истории", "ёлка вечеринка"]
+
+
+def make_users(count):
+    for i in range(count):
+        yield str(FIRST_USER_ID + i), {
+            "name": f"Пользователь {i}",
+            "faculty": "ФКН",
+            "registered_events": [],
+            "is_admin": False,
+            "active_event_creations": 0,
+            "version": 1,
+        }
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+async def bench_json_save_user(size, shards, repeats):
+    """Время save_user с фиксацией журнала и время сжатия журнала после изменения одного пользователя.
+
+    Сжатие с одним шардом — это прежнее поведение: переписывание всего users.json.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        users_dir = os.path.join(tmp, "users")
+        meta_file = os.path.join(tmp, "meta.json")
+        write_user_shards(users_dir, shards, make_users(size))
+        write_file_atomic(meta_file, dump_json({"user_shards": shards}))
+
+        backend = create_backend(
+            "json",
+            {
+                "events": (os.path.join(tmp, "events.json"), list),
+                "pending_events": (os.path.join(tmp, "photo.json"), list),
+                "meta": (meta_file, dict),
+            },
+            None, os.path.join(tmp, "journal.log"), users_dir=users_dir, user_shards=shards,
+        )
+        backend.load()
+        await backend.repository.compact()
+
+        save_times, compact_times = [], []
+        for i in range(repeats):
+            user_id = str(FIRST_USER_ID + random.randrange(size))
+            start = time.perf_counter()
+            user = backend.get_user(user_id)
+            user["active_event_creations"] = i % 2
+            backend.save_user(user_id, user)
+            await backend.repository.flush(force=True)
+            save_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await backend.repository.compact()
+            compact_times.append(time.perf_counter() - start)
+        return median_ms(save_times), median_ms(compact_times)
+
+
+def bench_sqlite_save_user(size, repeats):
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SqliteBackend(os.path.join(tmp, "bot.db"))
+        backend.load()
+        conn = backend.conn
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO users (user_id, name, faculty) VALUES (?, ?, ?)",
+                         ((user_id, user["name"], user["faculty"]) for user_id, user in make_users(size)))
+        conn.execute("COMMIT")
+
+        save_times = []
+        for i in range(repeats):
+            user_id = str(FIRST_USER_ID + random.randrange(size))
+            start = time.perf_counter()
+            user = backend.get_user(user_id)
+            user["active_event_creations"] = i % 2
+            backend.save_user(user_id, user)
+            save_times.append(time.perf_counter() - start)
+        backend.close_connections()
+        return median_ms(save_times)
+
+
+def make_events(count):
+    rng = random.Random(count)
+    for i in range(count):
+        yield i, {
+            "name": " ".join(rng.sample(EVENT_WORDS, 3)).capitalize(),
+            "description": " ".join(rng.choices(EVENT_WORDS, k=25)),
+            "location": f"Корпус {rng.randrange(1, 10)}, аудитория {rng.randrange(100, 500)}",
+            "time": f"{rng.randrange(1, 29):02}.{rng.randrange(1, 13):02}.{rng.choice([2026, 2027])}",
+        }
+
+
+def run_search(args):
+    print(f"{'мероприятий':>12} {'построение, мс':>15} {'запрос, мс':>11} {'обновление, мс':>15}")
+    for size in args.sizes:
+        events = list(make_events(size))
+        index = SearchIndex()
+        start = time.perf_counter()
+        for event_id, event in events:
+            index.add(event_id, event_document(event))
+        build_ms = (time.perf_counter() - start) * 1000
+
+        query_times = []
+        for _ in range(args.repeats):
+            for query in SEARCH_QUERIES:
+                start = time.perf_counter()
+                index.search(query)
+                query_times.append(time.perf_counter() - start)
+
+        update_times = []
+        for _ in range(args.repeats):
+            event_id, event = random.choice(events)
+            start = time.perf_counter()
+            index.add(event_id, event_document(event))
+            update_times.append(time.perf_counter() - start)
+        print(f"{size:>12} {build_ms:>15.1f} {median_ms(query_times):>11.3f} {median_ms(update_times):>15.3f}")
+
+
+# Действия inline кнопок бота и типы их аргументов — в порядке прежней регистрации обработчиков
+CALLBACK_ACTIONS = [
+    ("page", (str, int)), ("search_page", (int,)), ("my_page", (int,)), ("event", (int,)),
+    ("my_event", (int,)), ("consult_ai", ()), ("delete_event", (int,)), ("confirm_delete", (int,)),
+    ("none", ()), ("creator_info", (int,)), ("cancel_registration", (int,)), ("register_event", ()),
+    ("cancel_event_creation", ()), ("event_type", (str,)), ("register_for_event", (int,)),
+    ("back_to_main", ()), ("back_to_categories", ()), ("back_to_events", ()), ("category", (str,)),
+    ("view_events", ()), ("my_events", ()), ("edit_event", (int,)), ("view_participants", (int,)),
+    ("keep_current", ()), ("keep_category", ()),
+]
+CALLBACK_SAMPLES = [
+    "view_events", "category_all", "page_party_3", "event_1234", "register_for_event_1234", "my_events",
+    "my_page_1", "my_event_1234", "edit_event_1234", "keep_current", "event_type_boardgames", "back_to_main",
+]
+
+
+def make_callback_dispatchers():
+    """Два диспетчера aiogram с пустыми обработчиками всех кнопок бота.
+
+    Первый — прежняя схема: фильтр-лямбда на каждый обработчик, фильтры проверяются по
+    порядку регистрации. Второй — один обработчик, который выбирает маршрут по дереву.
+    """
+    async def handler(callback_query, *args, **kwargs):
+        pass
+
+    linear = Dispatcher()
+    for action, arg_types in CALLBACK_ACTIONS:
+        if arg_types:
+            prefix = f"{action}_"
+            linear.callback_query.register(handler, lambda c, prefix=prefix: c.data.startswith(prefix))
+        else:
+            linear.callback_query.register(handler, lambda c, action=action: c.data == action)
+
+    router = CallbackRouter()
+    for action, arg_types in CALLBACK_ACTIONS:
+        router.route(action, *arg_types)(handler)
+    routed = Dispatcher()
+
+    @routed.callback_query()
+    async def route_callback(callback_query, state):
+        await router.dispatch(callback_query, state)
+
+    return {"цепочка фильтров": linear, "дерево": routed}
+
+
+def make_callback_update(update_id, data):
+    user = {"id": FIRST_USER_ID, "is_bot": False, "first_name": "Тест"}
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": "1", "data": data,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": FIRST_USER_ID, "type": "private"}},
+        },
+    })
+
+
+async def bench_callbacks(repeats):
+    bot = Bot("123456:benchmark")
+    dispatchers = make_callback_dispatchers()
+    print(f"{'callback_data':>24}" + "".join(f" {name + ', мкс':>22}" for name in dispatchers))
+    for data in CALLBACK_SAMPLES:
+        update = make_callback_update(1, data)
+        row = []
+        for dispatcher in dispatchers.values():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                await dispatcher.feed_update(bot, update)
+            row.append((time.perf_counter() - start) / repeats * 1e6)
+        print(f"{data:>24}" + "".join(f" {value:>22.1f}" for value in row))
+    await bot.session.close()
+
+
+def run_callbacks(args):
+    # aiogram пишет в лог каждый обработанный апдейт — в замер это не входит
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    asyncio.run(bench_callbacks(args.repeats))
+
+
+AI_QUESTIONS = ["посоветуй настольные игры на выходных", "хочу на концерт или в театр", "куда сходить с друзьями"]
+
+
+def full_event_context(events):
+    """Прежняя подсказка: название и описание каждого мероприятия каталога."""
+    return "\n---\n".join(f"Название: {e.get('name', 'Без названия')}\nОписание: {e.get('description', 'Без описания')}"
+                           for _, e in events)
+
+
+async def bench_ai_context(args):
+    """Размер подсказки и время ответа с заглушкой AI, чья задержка растёт с длиной подсказки.
+
+    Заглушка отвечает через base_ms плюс prefill_ms на каждую 1000 токенов подсказки — так
+    у настоящей модели время до ответа растёт с длиной входа. Сравниваются весь каталог
+    (прежнее поведение) и отбор top-k по BM25 с ближайшими мероприятиями в пределах бюджета.
+    """
+    async def handle(request):
+        body = await request.json()
+        await asyncio.sleep((args.base_ms + args.prefill_ms * estimate_tokens(body["value"]) / 1000) / 1000)
+        return web.json_response({"choices": [{"message": {"content": "ok"}}]})
+
+    # Подсказка со всем каталогом из 10k мероприятий весит мегабайты
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.router.add_post("/ai", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    client = AIClient(f"http://127.0.0.1:{args.port}/ai", {}, pool_size=4)
+    client.start()
+
+    print(f"{'мероприятий':>12} {'подсказка':>10} {'токенов':>9} {'сборка, мс':>11} {'ответ, мс':>10}")
+    try:
+        for size in args.sizes:
+            events = list(make_events(size))
+            index = SearchIndex()
+            for event_id, event in events:
+                index.add(event_id, event_document(event))
+            by_id = dict(events)
+            upcoming = sorted(events, key=lambda item: event_sort_date(item[1]["time"]))[:args.upcoming]
+
+            def retrieval(question):
+                relevant = [(event_id, by_id[event_id]) for event_id, _ in index.search(question, limit=args.top_k)]
+                return build_event_context(relevant, upcoming, args.budget)
+
+            for name, build in (("весь", lambda question: full_event_context(events)), ("top-k", retrieval)):
+                build_times, total_times, tokens = [], [], []
+                for question in AI_QUESTIONS:
+                    start = time.perf_counter()
+                    context = build(question)
+                    build_times.append(time.perf_counter() - start)
+                    status, _ = await client.post_json({"value": f"МЕРОПРИЯТИЯ:\n{context}\n\nUser: {question}"})
+                    if status != 200:
+                        raise RuntimeError(f"заглушка AI ответила {status}")
+                    total_times.append(time.perf_counter() - start)
+                    tokens.append(estimate_tokens(context))
+                print(f"{size:>12} {name:>10} {int(statistics.median(tokens)):>9} "
+                      f"{median_ms(build_times):>11.2f} {median_ms(total_times):>10.0f}")
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def run_save_user(args):
+    print(f"{'пользователей':>14} {'хранилище':>14} {'save_user, мс':>14} {'сжатие, мс':>12}")
+    for size in args.sizes:
+        for shards in args.shards:
+            save_ms, compact_ms = asyncio.run(bench_json_save_user(size, shards, args.repeats))
+            print(f"{size:>14} {f'json/{shards}':>14} {save_ms:>14.3f} {compact_ms:>12.3f}")
+        print(f"{size:>14} {'sqlite':>14} {bench_sqlite_save_user(size, args.repeats):>14.3f} {'—':>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности бота")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    save_user_parser = commands.add_parser("save_user", help="Задержка save_user при разном числе пользователей")
+    save_user_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    save_user_parser.add_argument("--shards", type=int, nargs="+", default=[1, 16, 64])
+    save_user_parser.add_argument("--repeats", type=int, default=20)
+
+    search_parser = commands.add_parser("search", help="Построение индекса и время поисковых запросов")
+    search_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    search_parser.add_argument("--repeats", type=int, default=20)
+
+    callbacks_parser = commands.add_parser("callbacks", help="Стоимость выбора обработчика нажатия на кнопку")
+    callbacks_parser.add_argument("--repeats", type=int, default=2_000)
+
+    ai_context_parser = commands.add_parser("ai_context", help="Размер подсказки AI и время ответа")
+    ai_context_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000])
+    ai_context_parser.add_argument("--top-k", type=int, default=8)
+    ai_context_parser.add_argument("--upcoming", type=int, default=5)
+    ai_context_parser.add_argument("--budget", type=int, default=1500)
+    ai_context_parser.add_argument("--base-ms", type=float, default=300)
+    ai_context_parser.add_argument("--prefill-ms", type=float, default=20)
+    ai_context_parser.add_argument("--port", type=int, default=8098)
+
+    args = parser.parse_args()
+    if args.command == "save_user":
+        run_save_user(args)
+    elif args.command == "search":
+        run_search(args)
+    elif args.command == "callbacks":
+        run_callbacks(args)
+    elif args.command == "ai_context":
+        asyncio.run(bench_ai_context(args))
@@ -0,0 +1,94 @@
+import inspect
+import logging
+from typing import NamedTuple
+
+from aiogram.fsm.state import State
+
+
+class CallbackPayload(NamedTuple):
+    """Разобранная callback_data: действие и аргументы уже нужных типов."""
+    action: str
+    args: tuple
+
+
+class _Route(NamedTuple):
+    arg_types: tuple
+    states: object
+    handler: object
+    wants_state: bool
+
+
+def _in_states(current_state, states):
+    if isinstance(states, State):
+        return current_state == states.state
+    return current_state in states
+
+
+class CallbackRouter:
+    """Маршрутизация нажатий на inline кнопки по префиксному дереву вместо цепочки фильтров."""
+
+    def __init__(self):
+        # Узел дерева: [дети по части действия, маршруты действия, имя действия]
+        self._root = [{}, [], None]
+
+    def route(self, action, *arg_types, states=None):
+        """Регистрирует обработчик callback_data вида "действие_арг1_арг2" с аргументами типов arg_types."""
+        # С states (StatesGroup или State) маршрут выбирается, только когда пользователь в этом состоянии
+        def decorator(handler):
+            # Действие — путь по дереву из частей, разделённых "_": "event_type_party" и "event_5"
+            # оказываются разными узлами, и порядок регистрации не важен
+            node = self._root
+            for part in action.split("_"):
+                node = node[0].setdefault(part, [{}, [], None])
+            node[2] = action
+            wants_state = "state" in inspect.signature(handler).parameters
+            route = _Route(arg_types, states, handler, wants_state)
+            # Маршруты с условием на состояние проверяются раньше общего
+            if states is not None:
+                node[1].insert(0, route)
+            else:
+                node[1].append(route)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Находит маршруты для callback_data: (payload, маршруты) или (None, ()), если их нет."""
+        # Время поиска зависит от числа частей callback_data, а не от числа обработчиков.
+        # Всё, что осталось после действия, — аргументы, приводимые к типам маршрута
+        parts = data.split("_")
+        node = self._root
+        candidates = []
+        for depth, part in enumerate(parts):
+            node = node[0].get(part)
+            if node is None:
+                break
+            if node[1]:
+                candidates.append((depth + 1, node))
+        # Сначала самое длинное действие: "my_event_5" — это my_event(5), а не my(event, 5)
+        for depth, node in reversed(candidates):
+            raw_args = parts[depth:]
+            routes = [route for route in node[1] if len(route.arg_types) == len(raw_args)]
+            if not routes:
+                continue
+            try:
+                args = tuple(arg_type(raw) for arg_type, raw in zip(routes[0].arg_types, raw_args))
+            except ValueError:
+                continue
+            return CallbackPayload(node[2], args), routes
+        return None, ()
+
+    async def dispatch(self, callback_query, state):
+        """Вызывает обработчик нажатия; возвращает False, если подходящего нет."""
+        payload, routes = self.resolve(callback_query.data or "")
+        current_state = None
+        if any(route.states is not None for route in routes):
+            current_state = await state.get_state()
+        for route in routes:
+            if route.states is not None and not _in_states(current_state, route.states):
+                continue
+            kwargs = {"state": state} if route.wants_state else {}
+            await route.handler(callback_query, *payload.args, **kwargs)
+            return True
+        logging.warning(f"Нет обработчика для кнопки {callback_query.data!r}")
+        await callback_query.answer()
+        return False
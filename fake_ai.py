@@ -0,0 +1,71 @@
+"""Поддельный AI API для проверки бота: отвечает потоком (server-sent events) или целиком.
+
+Ответ «генерируется» со скоростью --tokens-per-second после задержки --first-token;
+с "stream": true в запросе порции уходят по мере генерации, без него — одним JSON в конце.
+
+    python fake_ai.py --port 8097
+    AI_URL=http://127.0.0.1:8097/ai AI_STREAM=1 python telegram_bot_collectoin_point.py
+"""
+import argparse
+import asyncio
+import json
+import re
+
+from aiohttp import web
+
+ARGS = web.AppKey("args", argparse.Namespace)
+
+ANSWER_WORDS = ("Советую заглянуть на {name} — там собираются студенты с похожими интересами, "
+                "можно прийти одному и быстро найти компанию. Если хочется чего-то поспокойнее, "
+                "посмотрите ближайшие мероприятия в списке категорий, там тоже есть интересные варианты.").split(" ")
+
+
+def make_answer(prompt, words):
+    # Советуем первое мероприятие из подсказки, если бот его передал
+    match = re.search(r"Название: (.+)", prompt)
+    name = f"«{match.group(1)}»" if match else "ближайшую встречу"
+    text = " ".join(ANSWER_WORDS).format(name=name).split(" ")
+    return [f"{word} " for word in (text * (words // len(text) + 1))[:words]]
+
+
+async def handle(request):
+    args = request.app[ARGS]
+    body = await request.json()
+    tokens = make_answer(body.get("value", ""), args.words)
+    await asyncio.sleep(args.first_token)
+    if not body.get("stream"):
+        await asyncio.sleep(len(tokens) / args.tokens_per_second)
+        return web.json_response({"choices": [{"message": {"content": "".join(tokens).strip()}}]})
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    for token in tokens:
+        chunk = {"choices": [{"delta": {"content": token}}]}
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await asyncio.sleep(1 / args.tokens_per_second)
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+def make_app(args):
+    app = web.Application()
+    app[ARGS] = args
+    app.router.add_post("/ai", handle)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка AI API с потоковыми ответами")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8097)
+    parser.add_argument("--first-token", type=float, default=1.0, help="секунд до первой порции")
+    parser.add_argument("--tokens-per-second", type=float, default=20)
+    parser.add_argument("--words", type=int, default=120, help="длина ответа в словах")
+    args = parser.parse_args()
+
+    web.run_app(make_app(args), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
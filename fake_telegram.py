@@ -0,0 +1,174 @@
+"""Поддельный Telegram для проверки бота в режиме вебхука под нагрузкой.
+
+Поднимает заглушку Bot API (отвечает успехом на любой метод) и шлёт на вебхук бота пачки
+апдейтов, измеряя время ответа вебхука и число обращений бота к API.
+
+    # терминал 1: бот с вебхуком, обращающийся к заглушке вместо api.telegram.org
+    BOT_MODE=webhook WEBHOOK_SECRET=secret TELEGRAM_API_URL=http://127.0.0.1:8081 \\
+        python telegram_bot_collectoin_point.py
+    # терминал 2
+    python fake_telegram.py --updates 1000 --batch 50 --secret secret
+
+С --scenario ai каждый пользователь нажимает «Посоветовать мероприятие» и задаёт вопрос;
+выводится, через сколько после вопроса пользователь увидел начало ответа AI и весь ответ
+(вместе с fake_ai.py и AI_STREAM=1 или без него).
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+api_calls = collections.Counter()
+message_ids = itertools.count(1)
+# chat_id -> моменты, когда бот показал текст ответа AI (отправкой или правкой сообщения)
+ai_reply_times = collections.defaultdict(list)
+# chat_id -> момент, когда пользователь задал вопрос
+ai_questions = {}
+
+
+def fake_message(chat_id, with_photo=False):
+    message = {
+        "message_id": next(message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id or 1), "type": "private"},
+    }
+    if with_photo:
+        message["photo"] = [{"file_id": "fake-photo", "file_unique_id": "fake-photo", "width": 1, "height": 1}]
+    return message
+
+
+async def handle_api(request):
+    method = request.match_info["method"]
+    api_calls[method] += 1
+    data = await request.post() if request.can_read_body else {}
+    if data.get("text", "").startswith("🤖"):
+        ai_reply_times[int(data["chat_id"])].append(time.perf_counter())
+    lowered = method.lower()
+    if lowered.startswith("send") or lowered.startswith("edit"):
+        result = fake_message(data.get("chat_id"), with_photo=lowered in ("sendphoto", "editmessagecaption"))
+    elif lowered == "getme":
+        result = {"id": 1, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }
+
+
+def make_callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}},
+        },
+    }
+
+
+async def post_ai_questions(args):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    update_ids = itertools.count(1)
+    async with aiohttp.ClientSession() as session:
+        async def ask(user_id):
+            await session.post(args.webhook, json=make_callback_update(next(update_ids), user_id, "consult_ai"),
+                               headers=headers)
+            # Ждём, пока бот переведёт пользователя в режим вопроса
+            await asyncio.sleep(1)
+            question = make_update(next(update_ids), user_id, f"посоветуй настольные игры на выходных, вопрос {user_id}")
+            del question["message"]["entities"]
+            ai_questions[user_id] = time.perf_counter()
+            await session.post(args.webhook, json=question, headers=headers)
+
+        await asyncio.gather(*(ask(100_000 + i) for i in range(args.users)))
+
+
+def report_ai_replies():
+    answered = {user_id: started for user_id, started in ai_questions.items() if ai_reply_times[user_id]}
+    if not answered:
+        print("ответов AI не было")
+        return
+    first = [ai_reply_times[user_id][0] - started for user_id, started in answered.items()]
+    last = [ai_reply_times[user_id][-1] - started for user_id, started in answered.items()]
+    shows = [len(ai_reply_times[user_id]) for user_id in answered]
+    print(f"ответили {len(answered)} из {len(ai_questions)}; до начала ответа: медиана {statistics.median(first):.2f} с, "
+          f"до полного ответа: медиана {statistics.median(last):.2f} с; "
+          f"показов текста на ответ: медиана {statistics.median(shows):.0f}")
+
+
+async def post_updates(args):
+    texts = ["/start", "/search настольные игры", "/search квиз"]
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    latencies, statuses = [], collections.Counter()
+    update_ids = itertools.count(1)
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            start = time.perf_counter()
+            async with session.post(args.webhook, json=update, headers=headers) as response:
+                await response.read()
+                statuses[response.status] += 1
+            latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        for batch_start in range(0, args.updates, args.batch):
+            batch = [make_update(next(update_ids), 100_000 + i % args.users, texts[i % len(texts)])
+                     for i in range(batch_start, min(batch_start + args.batch, args.updates))]
+            await asyncio.gather(*(post(update) for update in batch))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"апдейтов: {args.updates} за {elapsed:.2f} с, ответы вебхука: {dict(statuses)}")
+    print(f"время ответа вебхука: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} мс")
+
+
+async def main(args):
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", handle_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    try:
+        if args.scenario == "ai":
+            await post_ai_questions(args)
+        else:
+            await post_updates(args)
+        # Даём боту дообработать апдейты в фоне
+        await asyncio.sleep(args.settle)
+        print(f"обращения бота к API: {dict(api_calls)}")
+        if args.scenario == "ai":
+            report_ai_replies()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка вебхука бота")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--settle", type=float, default=5.0)
+    parser.add_argument("--scenario", choices=["commands", "ai"], default="commands")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from caches import LRUCache
+
+FSM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated);
+"""
+
+
+class SqliteFSMStorage(BaseStorage):
+    """Состояния диалогов (FSM) в SQLite: незаконченные сценарии переживают перезапуск бота."""
+
+    def __init__(self, db_path, ttl=None, cache_size=1024):
+        self.db_path = db_path
+        # Состояние, не менявшееся дольше ttl секунд, брошено: оно не возвращается и удаляется purge_expired()
+        self.ttl = ttl
+        # Write-through кэш недавних записей; верен, только пока базой владеет один процесс
+        # (нескольким процессам бота нужен Redis)
+        self.cache = LRUCache(cache_size)
+        self.key_builder = DefaultKeyBuilder()
+        # Один поток: запросы к базе выполняются в порядке вызова
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(FSM_SCHEMA)
+        return conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _expired(self, updated):
+        return bool(self.ttl) and updated < time.time() - self.ttl
+
+    # --- Выполняются в потоке хранилища ---
+
+    def _load_row(self, key):
+        row = self._db().execute("SELECT state, data, updated FROM fsm_states WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return [row[0], json.loads(row[1]), row[2]]
+
+    def _write_row(self, key, state, data, updated):
+        # Пустое состояние (после state.clear()) удаляется сразу, чтобы таблица не росла
+        if state is None and not data:
+            self._db().execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+        else:
+            self._db().execute(
+                "INSERT OR REPLACE INTO fsm_states (key, state, data, updated) VALUES (?, ?, ?, ?)",
+                (key, state, json.dumps(data, ensure_ascii=False), updated))
+
+    def _purge_rows(self, before):
+        return self._db().execute("DELETE FROM fsm_states WHERE updated < ?", (before,)).rowcount
+
+    # --- Интерфейс BaseStorage ---
+
+    async def _entry(self, key):
+        """[state, data, updated] по ключу; брошенное состояние возвращается пустым."""
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = await self._run(self._load_row, key) or [None, {}, 0.0]
+            self.cache.put(key, entry)
+        if entry[0] is not None or entry[1]:
+            if self._expired(entry[2]):
+                entry[0], entry[1] = None, {}
+        return entry
+
+    async def _save(self, key, entry):
+        entry[2] = time.time()
+        await self._run(self._write_row, key, entry[0], dict(entry[1]), entry[2])
+
+    async def set_state(self, key, state=None):
+        storage_key = self.key_builder.build(key)
+        entry = await self._entry(storage_key)
+        entry[0] = state.state if isinstance(state, State) else state
+        await self._save(storage_key, entry)
+
+    async def get_state(self, key):
+        return (await self._entry(self.key_builder.build(key)))[0]
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise TypeError(f"Данные состояния должны быть словарём, а не {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        entry = await self._entry(storage_key)
+        entry[1] = dict(data)
+        await self._save(storage_key, entry)
+
+    async def get_data(self, key):
+        return dict((await self._entry(self.key_builder.build(key)))[1])
+
+    async def purge_expired(self):
+        """Удаляет из базы состояния, не менявшиеся дольше ttl; возвращает их число."""
+        if not self.ttl:
+            return 0
+        return await self._run(self._purge_rows, time.time() - self.ttl)
+
+    def stats(self):
+        return self.cache.stats()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+            self._executor.shutdown(wait=True)
+
+
+def create_fsm_storage(kind, db_path, ttl=None, cache_size=1024, redis_url=None):
+    """Хранилище состояний диалогов: "sqlite" (по умолчанию), "redis" или "memory"."""
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "redis":
+        # Необязательная зависимость: пакет redis нужен только в этом режиме
+        from aiogram.fsm.storage.redis import RedisStorage
+        if not redis_url:
+            raise ValueError("Для FSM_STORAGE=redis нужно задать REDIS_URL")
+        # Redis сам удаляет ключи по истечении TTL; подходит и совместимый сервер (Valkey, KeyDB)
+        return RedisStorage.from_url(redis_url, state_ttl=ttl or None, data_ttl=ttl or None)
+    if kind != "sqlite":
+        raise ValueError(f"Неизвестный тип хранилища состояний: {kind}")
+    logging.info(f"Состояния диалогов хранятся в {db_path}")
+    return SqliteFSMStorage(db_path, ttl=ttl, cache_size=cache_size)
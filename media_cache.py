@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from storage import dump_json, read_json, write_file_atomic
+
+
+class MediaCache:
+    """Кэш file_id для локальных картинок, которые бот отправляет пользователям.
+
+    При первой отправке файл загружается в Telegram, и file_id из ответа запоминается
+    (и сохраняется в cache_file, чтобы пережить перезапуск). Дальше вместо повторной
+    загрузки отправляется только file_id. Ключ записи включает размер и время изменения
+    файла, поэтому после замены картинки она загрузится заново. Если Telegram отклонит
+    сохранённый file_id, запись удаляется, а файл загружается ещё раз.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._file_ids = {}
+        self._upload_locks = {}
+
+    def load(self):
+        self._file_ids = read_json(self.cache_file, {})
+
+    @staticmethod
+    def _fingerprint(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def get(self, path):
+        """Возвращает сохранённый file_id для файла или None, если файл нужно загрузить."""
+        entry = self._file_ids.get(path)
+        if entry and entry.get("fingerprint") == self._fingerprint(path):
+            return entry["file_id"]
+        return None
+
+    async def _save(self):
+        payload = dump_json(self._file_ids)
+        await asyncio.to_thread(write_file_atomic, self.cache_file, payload)
+
+    async def remember(self, path, file_id):
+        self._file_ids[path] = {"file_id": file_id, "fingerprint": self._fingerprint(path)}
+        await self._save()
+
+    async def forget(self, path):
+        if self._file_ids.pop(path, None) is not None:
+            await self._save()
+
+    async def _upload_photo(self, message, path, **kwargs):
+        # Параллельные первые отправки ждут одну загрузку и затем используют её file_id
+        lock = self._upload_locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            file_id = self.get(path)
+            if file_id:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            sent = await message.answer_photo(photo=FSInputFile(path), **kwargs)
+            await self.remember(path, sent.photo[-1].file_id)
+            return sent
+
+    async def answer_photo(self, message, path, **kwargs):
+        """message.answer_photo с картинкой из path: по file_id, если он уже известен."""
+        file_id = self.get(path)
+        if file_id is None:
+            return await self._upload_photo(message, path, **kwargs)
+        try:
+            return await message.answer_photo(photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if "file" not in str(e).lower():
+                raise
+            logging.warning(f"Telegram отклонил сохранённый file_id для {path}, загружаем файл заново: {e}")
+            if self.get(path) == file_id:
+                await self.forget(path)
+            return await self._upload_photo(message, path, **kwargs)
@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import glob
+import logging
+import os
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from rate_limiter import bulk_sends
+from storage import dump_json, read_json, write_file_atomic
+
+
+class NotificationQueue:
+    """Очередь рассылок участникам мероприятий, переживающая перезапуск."""
+
+    # Через сколько секунд повторить рассылку, прерванную ошибкой
+    RETRY_DELAY = 30
+    # Доставленные номера пишутся в файл прогресса не реже раза в PROGRESS_FLUSH_INTERVAL
+    # секунд или по PROGRESS_BATCH штук
+    PROGRESS_BATCH = 100
+    PROGRESS_FLUSH_INTERVAL = 1.0
+
+    def __init__(self, jobs_dir, bot, concurrency=20):
+        self.jobs_dir = jobs_dir
+        self.bot = bot
+        self.concurrency = concurrency
+        self._jobs = asyncio.Queue()
+        self._runner = None
+
+    def _job_file(self, job_id):
+        return os.path.join(self.jobs_dir, f"job_{job_id}.json")
+
+    def _progress_file(self, job_id):
+        return os.path.join(self.jobs_dir, f"job_{job_id}.progress")
+
+    def start(self):
+        """Ставит в очередь незавершённые рассылки прошлого запуска и запускает обработку."""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job_files = sorted(glob.glob(os.path.join(self.jobs_dir, "job_*.json")))
+        for job_file in job_files:
+            self._jobs.put_nowait(os.path.basename(job_file)[len("job_"):-len(".json")])
+        if job_files:
+            logging.info(f"Возобновляются незавершённые рассылки: {len(job_files)}")
+        self._runner = asyncio.create_task(self._run())
+
+    async def submit(self, recipients, text):
+        """Сохраняет рассылку и возвращается сразу; отправка идёт в фоне."""
+        recipients = list(recipients)
+        if not recipients:
+            return None
+        job_id = f"{time.time_ns()}"
+        # Текст и получатели сохраняются ещё до первой отправки, чтобы пережить перезапуск
+        payload = dump_json({"text": text, "recipients": recipients})
+        await asyncio.to_thread(write_file_atomic, self._job_file(job_id), payload)
+        self._jobs.put_nowait(job_id)
+        return job_id
+
+    def _load_progress(self, job_id):
+        try:
+            with open(self._progress_file(job_id), encoding="utf-8") as f:
+                # Последняя строка могла оборваться при падении — такие номера просто отправятся ещё раз
+                return {int(line) for line in f if line.strip().isdigit() and line.endswith("\n")}
+        except FileNotFoundError:
+            return set()
+
+    def _append_progress(self, job_id, indexes):
+        with open(self._progress_file(job_id), "a", encoding="utf-8") as f:
+            f.write("".join(f"{index}\n" for index in indexes))
+
+    def _remove_job(self, job_id):
+        for path in (self._job_file(job_id), self._progress_file(job_id)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    async def _run(self):
+        # Рассылки выполняются по одной; отправки внутри рассылки — в concurrency задачах
+        while True:
+            job_id = await self._jobs.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                # Например, пропала сеть: доставленное уже отмечено, остальное попробуем позже
+                logging.error(f"Ошибка рассылки {job_id}, повтор через {self.RETRY_DELAY} с: {e}")
+                asyncio.get_running_loop().call_later(self.RETRY_DELAY, self._jobs.put_nowait, job_id)
+
+    async def _run_job(self, job_id):
+        job = await asyncio.to_thread(read_json, self._job_file(job_id), None)
+        if job is None:
+            return
+        done = await asyncio.to_thread(self._load_progress, job_id)
+        # После перезапуска продолжаем с недоставленных: повторно могут уйти только
+        # сообщения последней пачки, не попавшей в job_<id>.progress
+        pending = ((index, user_id) for index, user_id in enumerate(job["recipients"]) if index not in done)
+
+        delivered = []
+        last_flush = time.monotonic()
+
+        async def flush_progress():
+            nonlocal last_flush
+            batch = delivered[:]
+            delivered.clear()
+            last_flush = time.monotonic()
+            if batch:
+                await asyncio.to_thread(self._append_progress, job_id, batch)
+
+        async def worker():
+            # Все задачи берут получателей из одного генератора: каждый получатель достаётся одной из них
+            for index, user_id in pending:
+                await self._deliver(user_id, job["text"])
+                delivered.append(index)
+                if (len(delivered) >= self.PROGRESS_BATCH
+                        or time.monotonic() - last_flush >= self.PROGRESS_FLUSH_INTERVAL):
+                    await flush_progress()
+
+        try:
+            # Полоса BULK: ответы пользователям уходят раньше рассылки
+            with bulk_sends():
+                # TaskGroup: при ошибке одной задачи остальные отменяются
+                async with asyncio.TaskGroup() as group:
+                    for _ in range(self.concurrency):
+                        group.create_task(worker())
+        finally:
+            # Доставленное после последней пачки отмечается и при ошибке, и при остановке
+            await flush_progress()
+
+        sent = len(job["recipients"]) - len(done)
+        await asyncio.to_thread(self._remove_job, job_id)
+        logging.info(f"Рассылка {job_id} завершена: отправлено {sent} из {len(job['recipients'])}")
+
+    async def _deliver(self, user_id, text):
+        try:
+            await self.bot.send_message(chat_id=int(user_id), text=text)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или чата больше нет — повторять бесполезно
+            logging.info(f"Уведомление пользователю {user_id} не доставлено: {e}")
+
+    async def close(self):
+        """Останавливает рассылки; недоставленное продолжится при следующем запуске."""
+        if self._runner is not None:
+            self._runner.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._runner
+            self._runner = None
@@ -0,0 +1,52 @@
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+
+# Предел длины текста сообщения в Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Знак в конце текста, пока ответ ещё пишется
+CURSOR = " ▌"
+
+
+class ProgressiveReply:
+    """Сообщение, которое дописывается по мере генерации ответа."""
+
+    def __init__(self, message, interval=1.0, prefix=""):
+        self.message = message
+        self.interval = interval
+        self.prefix = prefix
+        self.text = ""
+        self.edits = 0
+        self._shown = message.text
+        self._last_edit = 0.0
+
+    async def update(self, text):
+        self.text = text
+        # Не чаще раза в interval от конца прошлой правки: промежуточные версии просто пропускаются
+        if time.monotonic() - self._last_edit < self.interval:
+            return
+        limit = MAX_MESSAGE_LENGTH - len(self.prefix) - len(CURSOR)
+        await self._show(f"{self.prefix}{text[:limit]}{CURSOR}")
+
+    async def finish(self, text=None):
+        if text is not None:
+            self.text = text
+        limit = MAX_MESSAGE_LENGTH - len(self.prefix)
+        # Не поместившееся в одно сообщение уходит следующими сообщениями
+        parts = [self.text[i:i + limit] for i in range(0, len(self.text), limit)] or [""]
+        await self._show(f"{self.prefix}{parts[0]}")
+        for part in parts[1:]:
+            await self.message.answer(part)
+
+    async def _show(self, text):
+        if text == self._shown:
+            return
+        try:
+            await self.message.edit_text(text)
+        except TelegramBadRequest as e:
+            # Например, сообщение удалили — ответ просто перестаёт обновляться
+            logging.warning(f"Не удалось обновить сообщение с ответом: {e}")
+        self._shown = text
+        self.edits += 1
+        self._last_edit = time.monotonic()
@@ -0,0 +1,156 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Полоса, в которой уходят запросы текущей задачи; рассылки переключают её на BULK
+send_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def bulk_sends():
+    """Запросы внутри блока уходят в полосе рассылок и пропускают вперёд ответы пользователям."""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов с резервированием: reserve() сразу списывает токен и говорит, сколько ждать."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """Следующий токен появится не раньше чем через seconds (ответ 429 с retry_after)."""
+        self._refill(time.monotonic())
+        # Следующий reserve() спишет ещё один токен и получит ровно seconds ожидания
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Middleware сессии бота: лимиты скорости запросов в чаты, ответы пользователям раньше рассылок."""
+
+    # Вёдра чатов, которые давно не использовались, удаляются, когда их становится больше этого
+    MAX_IDLE_BUCKETS = 10_000
+
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, group_rate=20 / 60, max_retries=3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._lanes = {INTERACTIVE: collections.deque(), BULK: collections.deque()}
+        self._queued = asyncio.Event()
+        self._dispatcher = None
+        self._waiting_for_chat = 0
+        self.sent = 0
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.idle()}
+            # Отрицательный id (или @username канала) — группа или канал, у них лимит строже
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _run_dispatcher(self):
+        # Единственный диспетчер выпускает запросы с глобальной скоростью: сначала INTERACTIVE,
+        # а BULK — только когда ответов пользователям в очереди нет
+        while True:
+            if not any(self._lanes.values()):
+                self._queued.clear()
+                await self._queued.wait()
+            await asyncio.sleep(self.global_bucket.reserve())
+            # Полоса выбирается после ожидания: ответ, пришедший за это время, уйдёт раньше рассылки
+            lane = self._lanes[INTERACTIVE] or self._lanes[BULK]
+            future = lane.popleft()
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire(self, chat_id, priority):
+        # Сначала токен ведра чата, затем очередь своей полосы
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay:
+            self._waiting_for_chat += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._waiting_for_chat -= 1
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._run_dispatcher())
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(future)
+        self._queued.set()
+        await future
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        # Ограничиваются только запросы в чат (отправка и правка сообщений), остальные идут сразу
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logging.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой в чат {chat_id}")
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    def stats(self):
+        return {
+            "interactive_queue": len(self._lanes[INTERACTIVE]),
+            "bulk_queue": len(self._lanes[BULK]),
+            "waiting_for_chat": self._waiting_for_chat,
+            "chats": len(self._chat_buckets),
+            "sent": self.sent,
+            "retries": self.retries,
+        }
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
@@ -0,0 +1,107 @@
+import asyncio
+import contextlib
+import datetime
+import heapq
+import logging
+import time
+
+from storage import dump_json, event_sort_date, read_json, write_file_atomic
+
+
+class ReminderScheduler:
+    """Напоминания участникам за hours_before часов до мероприятия."""
+
+    # Сон не дольше часа: на случай перевода системных часов
+    MAX_SLEEP = 3600
+
+    def __init__(self, hours_before, sent_file, fire):
+        self.hours_before = hours_before
+        self.sent_file = sent_file
+        # async fire(event_id) — отправка напоминания, её делает бот
+        self.fire = fire
+        # Куча (время срабатывания, id, время мероприятия); актуальная запись мероприятия — в _scheduled,
+        # так что перенос и отмена не ищут запись в куче, а устаревшие пропускаются при извлечении
+        self._heap = []
+        self._scheduled = {}
+        # id мероприятия -> время, о котором уже напомнили: после перезапуска не напоминаем повторно
+        self._sent = {}
+        self._changed = asyncio.Event()
+        self._runner = None
+        self._firing = set()
+        self._save_lock = asyncio.Lock()
+
+    def _fire_at(self, start):
+        moment = datetime.datetime.fromisoformat(start) - datetime.timedelta(hours=self.hours_before)
+        return moment.timestamp()
+
+    def schedule(self, event_id, event):
+        """Ставит (или переносит) напоминание по текущему времени мероприятия."""
+        start = event_sort_date(event.get("time"))
+        if start is None or datetime.datetime.fromisoformat(start) <= datetime.datetime.now():
+            self.cancel(event_id)
+            return
+        if self._sent.get(str(event_id)) == start:
+            self._scheduled.pop(event_id, None)
+            return
+        if self._scheduled.get(event_id) == start:
+            return
+        self._scheduled[event_id] = start
+        heapq.heappush(self._heap, (self._fire_at(start), event_id, start))
+        self._changed.set()
+
+    def cancel(self, event_id):
+        self._scheduled.pop(event_id, None)
+
+    async def rebuild(self, events):
+        """Строит расписание по всем мероприятиям при запуске."""
+        self._sent = await asyncio.to_thread(read_json, self.sent_file, {})
+        event_ids = set()
+        for event_id, event in events:
+            event_ids.add(str(event_id))
+            self.schedule(event_id, event)
+        # Отметки об удалённых мероприятиях больше не нужны
+        self._sent = {key: value for key, value in self._sent.items() if key in event_ids}
+        logging.info(f"Запланировано напоминаний: {len(self._scheduled)}")
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Одна задача спит до ближайшего срабатывания или изменения расписания
+        while True:
+            self._changed.clear()
+            # Записи отменённых и перенесённых мероприятий просто выбрасываются
+            while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][2]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._changed.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._changed.wait(), min(delay, self.MAX_SLEEP))
+                continue
+            _, event_id, start = heapq.heappop(self._heap)
+            del self._scheduled[event_id]
+            task = asyncio.create_task(self._fire(event_id, start))
+            self._firing.add(task)
+            task.add_done_callback(self._firing.discard)
+
+    async def _fire(self, event_id, start):
+        try:
+            # Участников определяет fire() в момент срабатывания: отменившие регистрацию не получат
+            await self.fire(event_id)
+            # Отметка после отправки: при падении между ними напоминание скорее повторится, чем потеряется
+            self._sent[str(event_id)] = start
+            # Под блокировкой: иначе более старый снимок отметок мог бы записаться последним
+            async with self._save_lock:
+                await asyncio.to_thread(write_file_atomic, self.sent_file, dump_json(self._sent))
+        except Exception as e:
+            logging.error(f"Ошибка при отправке напоминания о мероприятии {event_id}: {e}")
+
+    async def close(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._runner
+            self._runner = None
@@ -0,0 +1,138 @@
+import bisect
+import functools
+import heapq
+import math
+import re
+from collections import Counter
+
+TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+# Окончания, которые отбрасываются при стемминге (сначала длинные)
+RUSSIAN_ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ших", "щих", "ться", "тся",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ом", "ем", "ам", "ям", "ах", "ях",
+    "ов", "ев", "ую", "юю", "ых", "их", "ия", "ии", "ию", "ть", "ет", "ит", "ут", "ют", "ат", "ят",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+ENGLISH_ENDINGS = ["ing", "es", "ed", "s"]
+MIN_STEM = 3
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е и разбиение на слова."""
+    return TOKEN_RE.findall((text or "").lower().replace("ё", "е"))
+
+
+# Словарь небольшой, а слова повторяются, поэтому основа каждого слова вычисляется один раз
+@functools.lru_cache(maxsize=65536)
+def stem(token):
+    """Грубый стемминг: отбрасывает одно окончание, если остаётся хотя бы MIN_STEM символов."""
+    endings = ENGLISH_ENDINGS if token.isascii() else RUSSIAN_ENDINGS
+    for ending in endings:
+        if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM:
+            return token[:-len(ending)]
+    return token
+
+
+def terms(text):
+    return [stem(token) for token in normalize(text)]
+
+
+def event_document(event):
+    # Название повторяется, чтобы совпадение в нём весило больше, чем в описании
+    name = event.get("name", "")
+    return f"{name} {name} {event.get('description', '')} {event.get('location', '')}"
+
+
+class SearchIndex:
+    """Инвертированный индекс с ранжированием BM25.
+
+    Для каждого терма хранятся документы, где он встречается, с числом вхождений; документ
+    можно добавить, заменить или удалить по одному, без перестроения индекса. Запрос
+    оценивает только документы из списков своих термов. Термы запроса, которых нет
+    в словаре целиком, дополняются по префиксу по отсортированному словарю, чтобы
+    находились недописанные слова («настол» -> «настольн»).
+    """
+
+    K1 = 1.5
+    B = 0.75
+    # Вес совпадений по префиксу относительно точных и сколько термов подставлять на префикс
+    PREFIX_WEIGHT = 0.7
+    MAX_PREFIX_TERMS = 20
+
+    def __init__(self):
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._vocabulary = []
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_terms
+
+    def add(self, doc_id, text):
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+        counts = Counter(terms(text))
+        self._doc_terms[doc_id] = counts
+        length = sum(counts.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._vocabulary, term)
+            postings[doc_id] = count
+
+    def remove(self, doc_id):
+        counts = self._doc_terms.pop(doc_id, None)
+        if counts is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in counts:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+
+    def _expand(self, term):
+        """Терм запроса -> [(терм словаря, вес)]: точное совпадение или термы с этим префиксом."""
+        if term in self._postings:
+            return [(term, 1.0)]
+        expanded = []
+        position = bisect.bisect_left(self._vocabulary, term)
+        while (position < len(self._vocabulary) and len(expanded) < self.MAX_PREFIX_TERMS
+               and self._vocabulary[position].startswith(term)):
+            expanded.append((self._vocabulary[position], self.PREFIX_WEIGHT))
+            position += 1
+        return expanded
+
+    def query_terms(self, query):
+        return [expansion for term in dict.fromkeys(terms(query)) for expansion in self._expand(term)]
+
+    def search(self, query, limit=None):
+        """Возвращает [(doc_id, score)] по убыванию релевантности."""
+        doc_count = len(self._doc_terms)
+        if not doc_count:
+            return []
+        average_length = self._total_length / doc_count or 1
+        # Части формулы BM25, не зависящие от документа, считаются один раз на запрос
+        norm_base = self.K1 * (1 - self.B)
+        norm_per_length = self.K1 * self.B / average_length
+        doc_lengths = self._doc_lengths
+        scores = {}
+        for term, weight in self.query_terms(query):
+            postings = self._postings[term]
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            term_weight = weight * idf * (self.K1 + 1)
+            for doc_id, count in postings.items():
+                norm = norm_base + norm_per_length * doc_lengths[doc_id]
+                scores[doc_id] = scores.get(doc_id, 0.0) + term_weight * count / (count + norm)
+        if limit is not None:
+            return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,1323 @@
+import asyncio
+import bisect
+import contextlib
+import datetime
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_json(filename, default):
+    """Читает JSON файл; если файла нет или он повреждён — возвращает значение по умолчанию."""
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except json.JSONDecodeError:
+        logging.error(f"Ошибка декодирования JSON в файле {filename}")
+        return default
+
+
+def write_file_atomic(filename, payload):
+    """Атомарно записывает файл: сначала во временный файл рядом, затем rename поверх старого."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filename)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dump_json(data):
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+class Repository:
+    """Коллекции в памяти: изменения дописываются в журнал, снимки на диск пишутся при сжатии журнала."""
+
+    def __init__(self, files, journal_file, flush_interval=1.0, max_dirty_age=5.0,
+                 journal_max_bytes=1024 * 1024, codecs=None):
+        # files: имя коллекции -> (путь к файлу, фабрика значения по умолчанию)
+        self.files = files
+        self.journal_file = journal_file
+        # codecs: имя коллекции -> (из формата файла в память, из памяти в формат файла)
+        self.codecs = codecs or {}
+        self.flush_interval = flush_interval
+        self.max_dirty_age = max_dirty_age
+        self.journal_max_bytes = journal_max_bytes
+        self._data = {}
+        self._buffer = []  # записи журнала, ещё не зафиксированные на диске
+        self._first_record = None
+        self._last_record = None
+        self._changed = set()  # коллекции, изменённые после последнего снимка
+        self._journal_size = 0
+        self._wakeup = asyncio.Event()
+        self._flusher = None
+        self._closing = False
+        # Пул потоков для записи файлов (None — стандартный пул asyncio)
+        self.executor = None
+
+    def load(self):
+        """Загружает снимки в память, создаёт отсутствующие файлы и проигрывает журнал."""
+        for name, (filename, default_factory) in self.files.items():
+            if not os.path.exists(filename):
+                write_file_atomic(filename, dump_json(default_factory()))
+            data = read_json(filename, default_factory())
+            decode = self.codecs.get(name, (None, None))[0]
+            self._data[name] = decode(data) if decode else data
+
+        replayed = 0
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Оборванная последняя запись — падение во время записи журнала
+                        logging.warning(f"Пропущена повреждённая запись журнала {self.journal_file}")
+                        continue
+                    if self._apply(record):
+                        self._changed.add(record["c"])
+                        replayed += 1
+            self._journal_size = os.path.getsize(self.journal_file)
+        except FileNotFoundError:
+            self._journal_size = 0
+        if replayed:
+            logging.info(f"Из журнала {self.journal_file} восстановлено изменений: {replayed}")
+
+    def _apply(self, record):
+        data = self._data.get(record["c"])
+        if data is None:
+            # Например, шард пользователей при другом числе шардов — не роняем запуск из-за одной записи
+            logging.warning(f"Пропущена запись журнала {self.journal_file} для неизвестной коллекции {record['c']}")
+            return False
+        if record["op"] == "put":
+            data[record["k"]] = record["v"]
+        elif record["op"] == "del":
+            data.pop(record["k"], None)
+        elif record["op"] == "set":
+            decode = self.codecs.get(record["c"], (None, None))[0]
+            self._data[record["c"]] = decode(record["v"]) if decode else record["v"]
+        return True
+
+    def _encode(self, name):
+        encode = self.codecs.get(name, (None, None))[1]
+        data = self._data[name]
+        return encode(data) if encode else data
+
+    def get(self, name):
+        return self._data[name]
+
+    def touch(self, name):
+        """Включает коллекцию в следующий снимок, даже если журнал её не менял."""
+        self._changed.add(name)
+
+    # --- Изменения: применяются в памяти сразу, на диск попадают через журнал ---
+
+    def put(self, name, key, value):
+        self._data[name][key] = value
+        self._record({"c": name, "op": "put", "k": key, "v": value})
+
+    def delete(self, name, key):
+        self._data[name].pop(key, None)
+        self._record({"c": name, "op": "del", "k": key})
+
+    def set(self, name, data):
+        """Заменяет коллекцию целиком (для маленьких коллекций без ключей)."""
+        self._data[name] = data
+        self._record({"c": name, "op": "set", "v": self._encode(name)})
+
+    def _record(self, record):
+        # Записи копятся в буфере и фиксируются одним fsync (group commit), но не ждут дольше max_dirty_age.
+        # Сериализуем сразу: в журнал попадает значение на момент изменения
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._changed.add(record["c"])
+        now = time.monotonic()
+        if self._first_record is None:
+            self._first_record = now
+        self._last_record = now
+        if now - self._first_record >= self.max_dirty_age:
+            self._wakeup.set()
+
+    def _append_journal(self, payload):
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    async def flush(self, force=False):
+        """Фиксирует накопленные записи журнала одним fsync, если пора (или сразу при force)."""
+        if not self._buffer:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_record < self.flush_interval \
+                and now - self._first_record < self.max_dirty_age:
+            return
+
+        payload = "".join(self._buffer)
+        self._buffer.clear()
+        self._first_record = None
+        try:
+            self._journal_size = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._append_journal, payload)
+        except OSError as e:
+            logging.error(f"Ошибка при записи журнала {self.journal_file}: {e}")
+            self._buffer.insert(0, payload)
+            self._first_record = self._last_record
+            return
+
+        if self._journal_size >= self.journal_max_bytes:
+            await self.compact()
+
+    def _write_snapshots(self, payloads):
+        for name, payload in payloads.items():
+            write_file_atomic(self.files[name][0], payload)
+        # Все изменения из журнала уже в снимках — журнал можно обрезать
+        with open(self.journal_file, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def compact(self):
+        """Записывает свежие снимки изменённых коллекций и обрезает журнал."""
+        # Записи журнала идемпотентны (put/del по ключу, set всей коллекции), поэтому падение
+        # посреди записи снимков не портит данные: при запуске журнал проигрывается поверх них.
+        # Снимки делаем в event loop, чтобы коллекции не менялись во время сериализации.
+        # Записи из буфера уже вошли в снимки, но попадут и в новый журнал — они идемпотентны.
+        payloads = {name: dump_json(self._encode(name)) for name in self._changed}
+        changed, self._changed = self._changed, set()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._write_snapshots, payloads)
+        except OSError as e:
+            logging.error(f"Ошибка при сжатии журнала {self.journal_file}: {e}")
+            self._changed |= changed
+            return
+        self._journal_size = 0
+        logging.info(f"Журнал {self.journal_file} сжат, обновлено снимков: {len(payloads)}")
+
+    async def _run_flusher(self):
+        # Журнал пишет только эта задача, поэтому записи попадают в файл строго по порядку
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._flusher is None:
+            self._closing = False
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self):
+        """Останавливает фоновую запись, фиксирует журнал и сохраняет свежие снимки."""
+        if self._flusher is not None:
+            # Не отменяем задачу, а даём ей дописать текущую пачку
+            self._closing = True
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+        await self.flush(force=True)
+        if self._changed:
+            await self.compact()
+
+
+def user_shard_index(user_id, shards):
+    """Номер шарда пользователя: стабильный хеш id, не зависящий от запуска процесса."""
+    return zlib.crc32(str(user_id).encode('utf-8')) % shards
+
+
+def user_shard_file(users_dir, index):
+    return os.path.join(users_dir, f"users_{index:03d}.json")
+
+
+class StaleVersionError(Exception):
+    """Запись изменилась с момента чтения: изменение, сделанное по старой версии, отклоняется."""
+
+
+def check_version(record, expected_version):
+    if expected_version is not None and (record or {}).get("version", 0) != expected_version:
+        raise StaleVersionError(f"ожидалась версия {expected_version}, текущая {(record or {}).get('version', 0)}")
+
+
+# ДД.ММ.ГГГГ и, возможно, ЧЧ:ММ где-то дальше в тексте поля time
+EVENT_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})(?:\D+(\d{1,2}):(\d{2}))?")
+
+
+def event_sort_date(time_text):
+    """Дата мероприятия из поля time в виде ISO строки для сортировки; None, если даты в тексте нет."""
+    match = EVENT_DATE_RE.search(time_text or "")
+    if match is None:
+        return None
+    day, month, year, hour, minute = match.groups()
+    try:
+        parsed = datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+    except ValueError:
+        return None
+    return parsed.isoformat(timespec="minutes")
+
+
+def event_date_order(event_id, sort_date):
+    # Мероприятия без распознанной даты идут в конце списка
+    return (sort_date is None, sort_date or "", event_id)
+
+
+# Поля, которые хранятся в отдельных колонках SQLite
+USER_FIELDS = ["name", "faculty", "is_admin", "active_event_creations"]
+EVENT_FIELDS = ["name", "description", "location", "time", "tg_link", "tg_chat_link", "category",
+                "category_name", "creator_id", "creator_name", "created_at", "edited_at"]
+
+
+class JsonBackend:
+    """Хранилище на JSON файлах: данные и индексы в памяти (Repository), пользователи — по шардам."""
+
+    # Чтения обслуживаются из памяти и не блокируют event loop
+    blocking = False
+
+    def __init__(self, repository, users_dir, user_shards=16, legacy_users_file=None, archive_file=None):
+        self.repository = repository
+        self.archive_file = archive_file
+        self.repository.codecs["events"] = (self._decode_events, lambda events: list(events.values()))
+        self.users_dir = users_dir
+        self.user_shards = user_shards
+        # Несегментированный users.json прежних версий: при первом запуске раскладывается по шардам
+        self.legacy_users_file = legacy_users_file
+        self._registrations = {}
+        self._by_category = {}
+        self._by_creator = {}
+        self._sort_dates = {}
+        self._by_date = []
+
+    def _shard(self, index):
+        return f"users_{index:03d}"
+
+    def _users(self, user_id):
+        return self.repository.get(self._shard(user_shard_index(user_id, self.user_shards)))
+
+    def _all_users(self):
+        for index in range(self.user_shards):
+            yield from self.repository.get(self._shard(index)).items()
+
+    def _setup_user_shards(self):
+        meta_file = self.repository.files["meta"][0]
+        stored_shards = read_json(meta_file, {}).get("user_shards")
+        if stored_shards and stored_shards != self.user_shards:
+            logging.warning(f"Пользователи разбиты на {stored_shards} шардов, а не на {self.user_shards}; "
+                            f"для смены числа шардов используйте python storage.py reshard")
+            self.user_shards = stored_shards
+        elif not stored_shards:
+            # Число шардов нужно знать до проигрывания журнала, поэтому оно пишется сразу,
+            # а не через журнал: иначе после падения до сжатия журнал не сойдётся с шардами
+            meta = read_json(meta_file, {})
+            meta["user_shards"] = self.user_shards
+            write_file_atomic(meta_file, dump_json(meta))
+
+        for index in range(self.user_shards):
+            self.repository.files[self._shard(index)] = (user_shard_file(self.users_dir, index), dict)
+
+        os.makedirs(self.users_dir, exist_ok=True)
+        if self.legacy_users_file and os.path.exists(self.legacy_users_file) and not stored_shards:
+            write_user_shards(self.users_dir, self.user_shards, read_json(self.legacy_users_file, {}).items())
+            os.replace(self.legacy_users_file, self.legacy_users_file + ".migrated")
+            logging.info(f"{self.legacy_users_file} разложен на {self.user_shards} шардов в {self.users_dir}")
+
+    def _decode_events(self, events):
+        decoded = {}
+        for position, event in enumerate(events):
+            if "id" not in event:
+                # Старые записи адресовались позицией в списке — она и становится их id
+                event["id"] = position
+                self._legacy_events = True
+            decoded[event["id"]] = event
+        return decoded
+
+    def load(self):
+        self._setup_user_shards()
+        self._legacy_events = False
+        self.repository.load()
+        if self._legacy_events:
+            # Выданные старым записям id попадут на диск со следующим снимком
+            self.repository.touch("events")
+
+        events = self.repository.get("events")
+        meta = self.repository.get("meta")
+        next_event_id = max([meta.get("next_event_id", 0)] + [event_id + 1 for event_id in events])
+        if next_event_id != meta.get("next_event_id"):
+            self.repository.put("meta", "next_event_id", next_event_id)
+        if meta.get("user_shards") != self.user_shards:
+            self.repository.put("meta", "user_shards", self.user_shards)
+
+        self._by_category = {}
+        self._by_creator = {}
+        self._sort_dates = {}
+        self._by_date = []
+        for event_id, event in events.items():
+            for key in ("all", event.get("category")):
+                self._by_category.setdefault(key, []).append(event_id)
+            self._index_creator(event_id, event)
+        for ids in self._by_category.values():
+            ids.sort()
+
+        self._registrations = {}
+        for user_id, user_data in self._all_users():
+            for event_id in user_data.get("registered_events", []):
+                # dict вместо set, чтобы сохранить порядок регистрации
+                self._registrations.setdefault(event_id, {})[user_id] = None
+
+    def set_executor(self, executor):
+        self.repository.executor = executor
+
+    def start(self):
+        self.repository.start()
+
+    async def close(self):
+        await self.repository.close()
+
+    def apply_batch(self, commands):
+        """Применяет пачку команд к состоянию в памяти; журнал зафиксирует их одним fsync."""
+        results = []
+        for method, args in commands:
+            try:
+                results.append((None, getattr(self, method)(*args)))
+            except Exception as e:
+                results.append((e, None))
+        return results
+
+    # --- Пользователи ---
+
+    def get_user(self, user_id):
+        return self._users(user_id).get(user_id)
+
+    def _put_user(self, user_id, user_data, previous_version):
+        user_data["version"] = previous_version + 1
+        self.repository.put(self._shard(user_shard_index(user_id, self.user_shards)), user_id, user_data)
+
+    def save_user(self, user_id, user_data, expected_version=None):
+        current = self.get_user(user_id)
+        check_version(current, expected_version)
+        self._put_user(user_id, user_data, (current or {}).get("version", 0))
+
+    def begin_event_creation(self, user_id, limit):
+        """Увеличивает счётчик создаваемых мероприятий, если лимит ещё не исчерпан."""
+        user = self.get_user(user_id)
+        if user is None:
+            return True
+        if user.get("active_event_creations", 0) >= limit:
+            return False
+        user["active_event_creations"] = user.get("active_event_creations", 0) + 1
+        self._put_user(user_id, user, user.get("version", 0))
+        return True
+
+    def finish_event_creation(self, user_id):
+        user = self.get_user(user_id)
+        if user is None or user.get("active_event_creations", 0) <= 0:
+            return False
+        user["active_event_creations"] -= 1
+        self._put_user(user_id, user, user.get("version", 0))
+        return True
+
+    # --- Мероприятия ---
+
+    def list_events(self):
+        return list(self.repository.get("events").items())
+
+    def get_event(self, event_id):
+        return self.repository.get("events").get(event_id)
+
+    def _index_event(self, event_id, category):
+        for key in ("all", category):
+            bisect.insort(self._by_category.setdefault(key, []), event_id)
+
+    def _index_creator(self, event_id, event):
+        self._by_creator.setdefault(event.get("creator_id"), set()).add(event_id)
+        self._index_date(event_id, event_sort_date(event.get("time")))
+
+    def _unindex_creator(self, event_id, event):
+        created = self._by_creator.get(event.get("creator_id"))
+        if created is not None:
+            created.discard(event_id)
+            if not created:
+                del self._by_creator[event.get("creator_id")]
+        self._unindex_date(event_id)
+
+    def _index_date(self, event_id, sort_date):
+        self._sort_dates[event_id] = sort_date
+        if sort_date is not None:
+            bisect.insort(self._by_date, (sort_date, event_id))
+
+    def _unindex_date(self, event_id):
+        sort_date = self._sort_dates.pop(event_id, None)
+        if sort_date is not None:
+            position = bisect.bisect_left(self._by_date, (sort_date, event_id))
+            if position < len(self._by_date) and self._by_date[position] == (sort_date, event_id):
+                del self._by_date[position]
+
+    def _unindex_event(self, event_id, category):
+        for key in ("all", category):
+            ids = self._by_category.get(key, [])
+            position = bisect.bisect_left(ids, event_id)
+            if position < len(ids) and ids[position] == event_id:
+                del ids[position]
+
+    def add_event(self, event_data):
+        event_id = self.repository.get("meta")["next_event_id"]
+        self.repository.put("meta", "next_event_id", event_id + 1)
+        event_data["id"] = event_id
+        event_data["version"] = 1
+        self.repository.put("events", event_id, event_data)
+        self._index_event(event_id, event_data.get("category"))
+        self._index_creator(event_id, event_data)
+        return event_id
+
+    def update_event(self, event_id, fields, expected_version=None):
+        event = self.get_event(event_id)
+        if event is None:
+            return False
+        check_version(event, expected_version)
+        if "category" in fields and fields["category"] != event.get("category"):
+            self._unindex_event(event_id, event.get("category"))
+            self._index_event(event_id, fields["category"])
+        event.update(fields)
+        event["version"] = event.get("version", 0) + 1
+        self.repository.put("events", event_id, event)
+        if "time" in fields:
+            self._unindex_date(event_id)
+            self._index_date(event_id, event_sort_date(event.get("time")))
+        return True
+
+    def delete_event(self, event_id, expected_version=None):
+        event = self.get_event(event_id)
+        if event is None:
+            return False
+        check_version(event, expected_version)
+        self.repository.delete("events", event_id)
+        self._unindex_event(event_id, event.get("category"))
+        self._unindex_creator(event_id, event)
+
+        # Снимаем регистрации только у участников этого мероприятия
+        for user_id in self._registrations.pop(event_id, ()):
+            user = self.get_user(user_id)
+            if user and event_id in user.get("registered_events", []):
+                user["registered_events"].remove(event_id)
+                self._put_user(user_id, user, user.get("version", 0))
+        return True
+
+    def events_page(self, category, offset, limit):
+        """Страница мероприятий категории и общее их число — срез готового индекса."""
+        events = self.repository.get("events")
+        ids = self._by_category.get(category, [])
+        return [(event_id, events[event_id]) for event_id in ids[offset:offset + limit]], len(ids)
+
+    def _date_range(self, start, end):
+        low = bisect.bisect_left(self._by_date, (start,)) if start else 0
+        high = bisect.bisect_left(self._by_date, (end,)) if end else len(self._by_date)
+        return low, max(low, high)
+
+    def events_between(self, start, end, offset, limit):
+        """Страница мероприятий с датой в [start, end) по возрастанию даты и общее их число."""
+        low, high = self._date_range(start, end)
+        page = self._by_date[low + offset:min(low + offset + limit, high)]
+        return [(event_id, self.get_event(event_id)) for _, event_id in page], high - low
+
+    def archive_candidates(self, before):
+        """Мероприятия раньше before вместе с их участниками — записи для архива."""
+        low, high = self._date_range(None, before)
+        # Копии: пока запись уходит в архив, мероприятие могут изменить, и тогда удаление не пройдёт проверку версии
+        return [{"event": dict(self.get_event(event_id)), "participants": self.participant_ids(event_id)}
+                for _, event_id in self._by_date[low:high]]
+
+    def write_archive(self, records):
+        # Дозапись с fsync до удаления из рабочих данных: при падении запись окажется в архиве дважды,
+        # но не потеряется; при чтении архива побеждает последняя запись с тем же id
+        with open(self.archive_file, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def user_events(self, user_id):
+        """Созданные пользователем мероприятия и те, на которые он записан, по дате проведения."""
+        event_ids = set(self.user_registrations(user_id)) | self._by_creator.get(user_id, set())
+        event_ids = sorted((event_id for event_id in event_ids if event_id in self._sort_dates),
+                           key=lambda event_id: event_date_order(event_id, self._sort_dates[event_id]))
+        return [(event_id, self.get_event(event_id)) for event_id in event_ids]
+
+    # --- Регистрации ---
+
+    def register(self, user_id, event_id):
+        user = self.get_user(user_id)
+        if user is None or self.get_event(event_id) is None:
+            return False
+        registered = user.setdefault("registered_events", [])
+        if event_id in registered:
+            return False
+        registered.append(event_id)
+        self._registrations.setdefault(event_id, {})[user_id] = None
+        self._put_user(user_id, user, user.get("version", 0))
+        return True
+
+    def cancel_registration(self, user_id, event_id):
+        user = self.get_user(user_id)
+        if user is None or event_id not in user.get("registered_events", []):
+            return False
+        user["registered_events"].remove(event_id)
+        self._registrations.get(event_id, {}).pop(user_id, None)
+        self._put_user(user_id, user, user.get("version", 0))
+        return True
+
+    def user_registrations(self, user_id):
+        user = self.get_user(user_id)
+        return list(user.get("registered_events", [])) if user else []
+
+    def participants(self, event_id, limit=None):
+        participants = []
+        for user_id in itertools.islice(self._registrations.get(event_id, {}), limit):
+            user_data = self.get_user(user_id) or {}
+            participants.append({"id": user_id, "name": user_data.get("name", "Пользователь"),
+                                 "faculty": user_data.get("faculty", "")})
+        return participants
+
+    def participant_ids(self, event_id):
+        return list(self._registrations.get(event_id, ()))
+
+    def participants_count(self, event_id):
+        return len(self._registrations.get(event_id, {}))
+
+    # --- Мероприятия на модерации ---
+
+    def list_pending(self):
+        return list(self.repository.get("pending_events"))
+
+    def add_pending(self, event_data):
+        self.repository.set("pending_events", self.list_pending() + [event_data])
+
+    def remove_pending(self, pending_idx):
+        pending = self.list_pending()
+        if 0 <= pending_idx < len(pending):
+            removed = pending.pop(pending_idx)
+            self.repository.set("pending_events", pending)
+            return removed
+        return None
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    faculty TEXT,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    active_event_creations INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    description TEXT,
+    location TEXT,
+    time TEXT,
+    tg_link TEXT,
+    tg_chat_link TEXT,
+    category TEXT,
+    category_name TEXT,
+    creator_id TEXT,
+    creator_name TEXT,
+    created_at TEXT,
+    edited_at TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    event_date TEXT
+);
+CREATE TABLE IF NOT EXISTS registrations (
+    user_id TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, event_id)
+);
+CREATE TABLE IF NOT EXISTS events_archive (
+    id INTEGER PRIMARY KEY,
+    event_date TEXT,
+    data TEXT NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_category ON events(category);
+CREATE INDEX IF NOT EXISTS idx_events_creator_id ON events(creator_id);
+CREATE INDEX IF NOT EXISTS idx_registrations_event ON registrations(event_id);
+CREATE INDEX IF NOT EXISTS idx_registrations_user ON registrations(user_id);
+"""
+
+
+# Базы первой версии адресовали мероприятия позицией; при открытии она становится id
+SQLITE_POSITION_MIGRATION = """
+DROP INDEX IF EXISTS idx_events_position;
+DROP INDEX IF EXISTS idx_events_category;
+DROP INDEX IF EXISTS idx_events_creator_id;
+DROP INDEX IF EXISTS idx_registrations_event;
+DROP INDEX IF EXISTS idx_registrations_user;
+ALTER TABLE events RENAME TO events_by_position;
+ALTER TABLE registrations RENAME TO registrations_by_position;
+"""
+
+
+def _row_to_dict(row, fields):
+    return {field: row[field] for field in fields if row[field] is not None}
+
+
+def _row_to_event(row):
+    event = _row_to_dict(row, EVENT_FIELDS)
+    event["id"] = row["id"]
+    event["version"] = row["version"]
+    return event
+
+
+class SqliteBackend:
+    """Хранилище в SQLite (WAL): выборки по категории, создателю и участникам идут по индексам."""
+
+    blocking = True
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        # У каждого потока своё соединение: в WAL чтения идут параллельно с записью,
+        # а одновременные записи SQLite сериализует сама (с ожиданием до timeout)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        if getattr(self._local, "in_batch", False):
+            # Внутри пачки команда откатывается только до своей точки сохранения
+            self.conn.execute("SAVEPOINT command")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK TO command")
+                self.conn.execute("RELEASE command")
+                raise
+            self.conn.execute("RELEASE command")
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def apply_batch(self, commands):
+        """Выполняет пачку команд в одной транзакции — один коммит на всю пачку."""
+        results = []
+        with self._transaction():
+            self._local.in_batch = True
+            try:
+                for method, args in commands:
+                    try:
+                        results.append((None, getattr(self, method)(*args)))
+                    except Exception as e:
+                        results.append((e, None))
+            finally:
+                self._local.in_batch = False
+        return results
+
+    def load(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        event_columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(events)")]
+        if "position" in event_columns:
+            self._migrate_positions_to_ids()
+        else:
+            self.conn.executescript(SQLITE_SCHEMA)
+        # Колонки версий появились позже — добавляем их в старые базы
+        for table in ("users", "events"):
+            columns = [row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if "version" not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(events)")]
+        if "event_date" not in columns:
+            self.conn.execute("ALTER TABLE events ADD COLUMN event_date TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_events_event_date ON events(event_date)")
+        self._fill_event_dates()
+
+    def _fill_event_dates(self):
+        # Разобранная дата для сортировки; у перенесённых и старых записей её ещё нет
+        rows = self.conn.execute("SELECT id, time FROM events WHERE event_date IS NULL AND time IS NOT NULL")
+        updates = [(event_sort_date(row["time"]), row["id"]) for row in rows.fetchall()]
+        updates = [(sort_date, event_id) for sort_date, event_id in updates if sort_date is not None]
+        if updates:
+            with self._transaction():
+                self.conn.executemany("UPDATE events SET event_date = ? WHERE id = ?", updates)
+
+    def _migrate_positions_to_ids(self):
+        self.conn.executescript(SQLITE_POSITION_MIGRATION)
+        self.conn.executescript(SQLITE_SCHEMA)
+        columns = ", ".join(EVENT_FIELDS)
+        self.conn.execute(f"INSERT INTO events (id, {columns}) SELECT position, {columns} FROM events_by_position")
+        self.conn.execute("INSERT INTO registrations (user_id, event_id) "
+                          "SELECT user_id, event_position FROM registrations_by_position")
+        self.conn.executescript("DROP TABLE events_by_position; DROP TABLE registrations_by_position;")
+
+    def set_executor(self, executor):
+        pass
+
+    def start(self):
+        pass
+
+    def close_connections(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    async def close(self):
+        self.close_connections()
+
+    # --- Пользователи ---
+
+    def get_user(self, user_id):
+        row = self.conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user = _row_to_dict(row, USER_FIELDS)
+        user["is_admin"] = bool(user.get("is_admin"))
+        user["version"] = row["version"]
+        user["registered_events"] = self.user_registrations(user_id)
+        return user
+
+    def _user_version(self, user_id):
+        row = self.conn.execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _bump_user_version(self, user_id):
+        self.conn.execute("UPDATE users SET version = version + 1 WHERE user_id = ?", (user_id,))
+
+    def save_user(self, user_id, user_data, expected_version=None):
+        # registered_events хранится в таблице registrations и меняется через register/cancel_registration
+        with self._transaction():
+            version = self._user_version(user_id)
+            check_version({"version": version or 0}, expected_version)
+            self.conn.execute(
+                "INSERT INTO users (user_id, name, faculty, is_admin, active_event_creations) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, faculty = excluded.faculty, "
+                "is_admin = excluded.is_admin, active_event_creations = excluded.active_event_creations, "
+                "version = version + 1",
+                (user_id, user_data.get("name"), user_data.get("faculty"),
+                 int(bool(user_data.get("is_admin", False))), user_data.get("active_event_creations", 0))
+            )
+
+    def begin_event_creation(self, user_id, limit):
+        """Увеличивает счётчик создаваемых мероприятий, если лимит ещё не исчерпан."""
+        with self._transaction():
+            if self._user_version(user_id) is None:
+                return True
+            cursor = self.conn.execute(
+                "UPDATE users SET active_event_creations = active_event_creations + 1, version = version + 1 "
+                "WHERE user_id = ? AND active_event_creations < ?", (user_id, limit))
+        return cursor.rowcount > 0
+
+    def finish_event_creation(self, user_id):
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE users SET active_event_creations = active_event_creations - 1, version = version + 1 "
+                "WHERE user_id = ? AND active_event_creations > 0", (user_id,))
+        return cursor.rowcount > 0
+
+    # --- Мероприятия ---
+
+    def _events(self, where="", params=(), limit=""):
+        rows = self.conn.execute(f"SELECT * FROM events {where} ORDER BY id {limit}", params).fetchall()
+        return [(row["id"], _row_to_event(row)) for row in rows]
+
+    def list_events(self):
+        return self._events()
+
+    def get_event(self, event_id):
+        row = self.conn.execute("SELECT * FROM events WHERE id = ?", (event_id,)).fetchone()
+        return _row_to_event(row) if row else None
+
+    def add_event(self, event_data):
+        with self._transaction():
+            event_id = self._insert_event(event_data)
+        event_data["id"] = event_id
+        event_data["version"] = 1
+        return event_id
+
+    def _insert_event(self, event_data, event_id=None):
+        columns = ["id", "event_date"] + EVENT_FIELDS
+        cursor = self.conn.execute(
+            f"INSERT INTO events ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [event_id, event_sort_date(event_data.get("time"))] + [event_data.get(field) for field in EVENT_FIELDS]
+        )
+        return cursor.lastrowid
+
+    def _event_version(self, event_id):
+        row = self.conn.execute("SELECT version FROM events WHERE id = ?", (event_id,)).fetchone()
+        return row[0] if row else None
+
+    def update_event(self, event_id, fields, expected_version=None):
+        fields = {k: v for k, v in fields.items() if k in EVENT_FIELDS}
+        if "time" in fields:
+            fields["event_date"] = event_sort_date(fields["time"])
+        assignments = "".join(f"{field} = ?, " for field in fields)
+        with self._transaction():
+            version = self._event_version(event_id)
+            if version is None:
+                return False
+            check_version({"version": version}, expected_version)
+            self.conn.execute(f"UPDATE events SET {assignments}version = version + 1 WHERE id = ?",
+                              list(fields.values()) + [event_id])
+        return True
+
+    def delete_event(self, event_id, expected_version=None):
+        with self._transaction():
+            version = self._event_version(event_id)
+            if version is None:
+                return False
+            check_version({"version": version}, expected_version)
+            self.conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+            # Версии участников растут: их списки мероприятий изменились
+            self.conn.execute("UPDATE users SET version = version + 1 WHERE user_id IN "
+                              "(SELECT user_id FROM registrations WHERE event_id = ?)", (event_id,))
+            self.conn.execute("DELETE FROM registrations WHERE event_id = ?", (event_id,))
+        return True
+
+    def events_page(self, category, offset, limit):
+        if category == "all":
+            where, params = "", ()
+        else:
+            where, params = "WHERE category = ?", (category,)
+        total = self.conn.execute(f"SELECT COUNT(*) FROM events {where}", params).fetchone()[0]
+        return self._events(where, params + (limit, offset), "LIMIT ? OFFSET ?"), total
+
+    def events_between(self, start, end, offset, limit):
+        where = "WHERE event_date >= ? AND event_date < ?"
+        params = (start or "", end or "\uffff")
+        total = self.conn.execute(f"SELECT COUNT(*) FROM events {where}", params).fetchone()[0]
+        rows = self.conn.execute(f"SELECT * FROM events {where} ORDER BY event_date, id LIMIT ? OFFSET ?",
+                                 params + (limit, offset)).fetchall()
+        return [(row["id"], _row_to_event(row)) for row in rows], total
+
+    def archive_candidates(self, before):
+        rows = self.conn.execute("SELECT * FROM events WHERE event_date < ? ORDER BY event_date, id",
+                                 (before,)).fetchall()
+        return [{"event": _row_to_event(row), "participants": self.participant_ids(row["id"])} for row in rows]
+
+    def write_archive(self, records):
+        archived_at = datetime.datetime.now().isoformat()
+        with self._transaction():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO events_archive (id, event_date, data, archived_at) VALUES (?, ?, ?, ?)",
+                [(record["event"]["id"], event_sort_date(record["event"].get("time")),
+                  json.dumps(record, ensure_ascii=False), archived_at) for record in records]
+            )
+
+    def user_events(self, user_id):
+        rows = self.conn.execute(
+            "SELECT * FROM events WHERE id IN (SELECT event_id FROM registrations WHERE user_id = ? "
+            "UNION SELECT id FROM events WHERE creator_id = ?) "
+            "ORDER BY event_date IS NULL, event_date, id", (user_id, user_id)
+        ).fetchall()
+        return [(row["id"], _row_to_event(row)) for row in rows]
+
+    # --- Регистрации ---
+
+    def register(self, user_id, event_id):
+        with self._transaction():
+            if self._user_version(user_id) is None:
+                return False
+            # Регистрация на уже удалённое мероприятие просто не вставится
+            cursor = self.conn.execute("INSERT OR IGNORE INTO registrations (user_id, event_id) "
+                                       "SELECT ?, id FROM events WHERE id = ?", (user_id, event_id))
+            if cursor.rowcount > 0:
+                self._bump_user_version(user_id)
+        return cursor.rowcount > 0
+
+    def cancel_registration(self, user_id, event_id):
+        with self._transaction():
+            cursor = self.conn.execute("DELETE FROM registrations WHERE user_id = ? AND event_id = ?",
+                                       (user_id, event_id))
+            if cursor.rowcount > 0:
+                self._bump_user_version(user_id)
+        return cursor.rowcount > 0
+
+    def user_registrations(self, user_id):
+        rows = self.conn.execute("SELECT event_id FROM registrations WHERE user_id = ? ORDER BY rowid",
+                                 (user_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def participants(self, event_id, limit=None):
+        rows = self.conn.execute(
+            "SELECT u.user_id, u.name, u.faculty FROM registrations r JOIN users u ON u.user_id = r.user_id "
+            "WHERE r.event_id = ? ORDER BY r.rowid LIMIT ?", (event_id, -1 if limit is None else limit)
+        ).fetchall()
+        return [{"id": row["user_id"], "name": row["name"] or "Пользователь", "faculty": row["faculty"] or ""}
+                for row in rows]
+
+    def participant_ids(self, event_id):
+        rows = self.conn.execute("SELECT user_id FROM registrations WHERE event_id = ? ORDER BY rowid",
+                                 (event_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def participants_count(self, event_id):
+        # Считается по индексу idx_registrations_event, без чтения строк пользователей
+        return self.conn.execute("SELECT COUNT(*) FROM registrations WHERE event_id = ?", (event_id,)).fetchone()[0]
+
+    # --- Мероприятия на модерации ---
+
+    def list_pending(self):
+        rows = self.conn.execute("SELECT data FROM pending_events ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add_pending(self, event_data):
+        with self._transaction():
+            self.conn.execute("INSERT INTO pending_events (data) VALUES (?)",
+                              (json.dumps(event_data, ensure_ascii=False),))
+
+    def remove_pending(self, pending_idx):
+        row = self.conn.execute("SELECT id, data FROM pending_events ORDER BY id LIMIT 1 OFFSET ?",
+                                (pending_idx,)).fetchone()
+        if pending_idx < 0 or row is None:
+            return None
+        with self._transaction():
+            self.conn.execute("DELETE FROM pending_events WHERE id = ?", (row["id"],))
+        return json.loads(row["data"])
+
+
+class AsyncStorage:
+    """Асинхронный фасад над хранилищем: чтения в пуле потоков, записи — командами через очередь коллекции."""
+
+    # Метод хранилища -> очередь коллекции, через которую он пишет
+    WRITES = {
+        "save_user": "users",
+        "begin_event_creation": "users",
+        "finish_event_creation": "users",
+        "register": "users",
+        "cancel_registration": "users",
+        "add_event": "events",
+        "update_event": "events",
+        "delete_event": "events",
+        "add_pending": "pending_events",
+        "remove_pending": "pending_events",
+    }
+    # Записи, после которых меняются списки мероприятий
+    CATALOG_WRITES = {"add_event", "update_event", "delete_event"}
+    # Записи, после которых меняется список мероприятий пользователя (первый аргумент — user_id)
+    USER_WRITES = {"save_user", "register", "cancel_registration"}
+
+    def __init__(self, backend, max_workers=4, max_batch=100):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+        self.backend.set_executor(self.executor)
+        self._queues = {}
+        self._writers = []
+        self.catalog_version = 0
+        self._user_versions = {}
+
+    async def _run_blocking(self, func, *args):
+        if not self.backend.blocking:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def load(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.backend.load)
+
+    def start(self):
+        self.backend.start()
+        for collection in set(self.WRITES.values()):
+            queue = asyncio.Queue()
+            self._queues[collection] = queue
+            self._writers.append(asyncio.create_task(self._run_writer(queue)))
+
+    async def _run_writer(self, queue):
+        stopping = False
+        while not stopping:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            if None in batch:
+                # Команды, поставленные до остановки, всё равно выполняются
+                stopping = True
+                batch = batch[:batch.index(None)]
+            if not batch:
+                continue
+
+            commands = [(method, args) for method, args, _ in batch]
+            try:
+                results = await self._run_blocking(self.backend.apply_batch, commands)
+            except Exception as e:
+                logging.error(f"Ошибка при записи в хранилище: {e}")
+                results = [(e, None)] * len(batch)
+            # Версии увеличиваются только когда изменения уже видны читателям
+            for method, args in commands:
+                self._bump_versions(method, args)
+
+            for (_, _, future), (error, result) in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def close(self):
+        """Дожидается всех поставленных в очереди записей и закрывает хранилище."""
+        for queue in self._queues.values():
+            queue.put_nowait(None)
+        await asyncio.gather(*self._writers)
+        self._writers.clear()
+        self._queues.clear()
+        await self.backend.close()
+        self.executor.shutdown(wait=True)
+
+    def _bump_versions(self, method, args):
+        if method in self.CATALOG_WRITES:
+            self.catalog_version += 1
+        if method in self.USER_WRITES:
+            self._user_versions[args[0]] = self._user_versions.get(args[0], 0) + 1
+
+    def user_version(self, user_id):
+        return self._user_versions.get(user_id, 0)
+
+    async def _write(self, method, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._queues[self.WRITES[method]].put_nowait((method, args, future))
+        # shield: отмена обработчика не должна отменять уже поставленную в очередь запись
+        return await asyncio.shield(future)
+
+    async def _read(self, method, *args):
+        return await self._run_blocking(getattr(self.backend, method), *args)
+
+    # --- Чтение ---
+
+    async def get_user(self, user_id):
+        return await self._read("get_user", user_id)
+
+    async def list_events(self):
+        return await self._read("list_events")
+
+    async def get_event(self, event_id):
+        return await self._read("get_event", event_id)
+
+    async def events_page(self, category, offset, limit):
+        return await self._read("events_page", category, offset, limit)
+
+    async def user_events(self, user_id):
+        return await self._read("user_events", user_id)
+
+    async def events_between(self, start, end, offset, limit):
+        return await self._read("events_between", start, end, offset, limit)
+
+    async def user_registrations(self, user_id):
+        return await self._read("user_registrations", user_id)
+
+    async def participants(self, event_id, limit=None):
+        return await self._read("participants", event_id, limit)
+
+    async def participant_ids(self, event_id):
+        return await self._read("participant_ids", event_id)
+
+    async def participants_count(self, event_id):
+        return await self._read("participants_count", event_id)
+
+    async def list_pending(self):
+        return await self._read("list_pending")
+
+    # --- Запись ---
+
+    async def save_user(self, user_id, user_data, expected_version=None):
+        return await self._write("save_user", user_id, user_data, expected_version)
+
+    async def begin_event_creation(self, user_id, limit):
+        return await self._write("begin_event_creation", user_id, limit)
+
+    async def finish_event_creation(self, user_id):
+        return await self._write("finish_event_creation", user_id)
+
+    async def register(self, user_id, event_id):
+        return await self._write("register", user_id, event_id)
+
+    async def cancel_registration(self, user_id, event_id):
+        return await self._write("cancel_registration", user_id, event_id)
+
+    async def add_event(self, event_data):
+        return await self._write("add_event", event_data)
+
+    async def update_event(self, event_id, fields, expected_version=None):
+        return await self._write("update_event", event_id, fields, expected_version)
+
+    async def delete_event(self, event_id, expected_version=None):
+        return await self._write("delete_event", event_id, expected_version)
+
+    async def add_pending(self, event_data):
+        return await self._write("add_pending", event_data)
+
+    async def archive_events(self, before):
+        """Переносит мероприятия с датой раньше before в архив и возвращает id перенесённых.
+
+        Сначала записи надёжно сохраняются в архиве, затем мероприятия удаляются из рабочих
+        данных обычными командами удаления с проверкой версии: мероприятие, изменённое
+        в промежутке, останется на месте и будет заархивировано при следующем проходе.
+        """
+        records = await self._read("archive_candidates", before)
+        if not records:
+            return []
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.backend.write_archive, records)
+        archived = []
+        results = await asyncio.gather(
+            *(self.delete_event(record["event"]["id"], record["event"].get("version")) for record in records),
+            return_exceptions=True)
+        for record, result in zip(records, results):
+            if result is True:
+                archived.append(record["event"]["id"])
+            elif isinstance(result, Exception) and not isinstance(result, StaleVersionError):
+                logging.error(f"Ошибка при архивировании мероприятия {record['event']['id']}: {result}")
+        return archived
+
+    async def remove_pending(self, pending_idx):
+        return await self._write("remove_pending", pending_idx)
+
+
+def write_user_shards(users_dir, shards, users):
+    """Раскладывает пользователей по файлам шардов (используется при переходе и решардинге)."""
+    buckets = [{} for _ in range(shards)]
+    for user_id, user_data in users:
+        buckets[user_shard_index(user_id, shards)][user_id] = user_data
+    os.makedirs(users_dir, exist_ok=True)
+    for index, bucket in enumerate(buckets):
+        write_file_atomic(user_shard_file(users_dir, index), dump_json(bucket))
+
+
+def create_backend(kind, files, db_path, journal_file, users_dir="users", user_shards=16, users_file=None,
+                   flush_interval=1.0, max_dirty_age=5.0, journal_max_bytes=1024 * 1024,
+                   archive_file="events_archive.jsonl"):
+    """Создаёт хранилище по имени: "json" (по умолчанию) или "sqlite".
+
+    SQLite пользователей не шардирует: запись строки в B-дереве и так не зависит от числа пользователей.
+    """
+    if kind == "sqlite":
+        return SqliteBackend(db_path)
+    if kind != "json":
+        raise ValueError(f"Неизвестный тип хранилища: {kind}")
+    repository = Repository(dict(files), journal_file, flush_interval=flush_interval,
+                            max_dirty_age=max_dirty_age, journal_max_bytes=journal_max_bytes)
+    return JsonBackend(repository, users_dir, user_shards, legacy_users_file=users_file, archive_file=archive_file)
+
+
+def migrate_json_to_sqlite(json_backend, db_path):
+    """Однократно переносит данные JSON хранилища (снимки и журнал) в базу SQLite.
+
+    Мероприятия без id получают id, равный позиции в списке, как и в JsonBackend.
+    """
+    json_backend.load()
+    users = list(json_backend._all_users())
+    events = json_backend.list_events()
+    pending = json_backend.list_pending()
+
+    backend = SqliteBackend(db_path)
+    backend.load()
+    try:
+        for user_id, user_data in users:
+            backend.save_user(user_id, user_data)
+        with backend._transaction():
+            backend.conn.execute("DELETE FROM events")
+            backend.conn.execute("DELETE FROM registrations")
+            for event_id, event_data in events:
+                backend._insert_event(event_data, event_id)
+        for user_id, user_data in users:
+            for event_id in user_data.get("registered_events", []):
+                backend.register(user_id, event_id)
+        with backend._transaction():
+            backend.conn.execute("DELETE FROM pending_events")
+        for event_data in pending:
+            backend.add_pending(event_data)
+    finally:
+        backend.close_connections()
+    logging.info(f"Перенесено в {db_path}: пользователей {len(users)}, мероприятий {len(events)}, "
+                 f"на модерации {len(pending)}")
+
+
+def reshard_users(json_backend, new_shards):
+    """Перераскладывает пользователей JSON хранилища на new_shards шардов.
+
+    Запускается при остановленном боте: сначала журнал сворачивается в снимки,
+    затем шарды пишутся в новый каталог и подменяют старый.
+    """
+    json_backend.load()
+    asyncio.run(json_backend.repository.compact())
+    users = list(json_backend._all_users())
+    users_dir = json_backend.users_dir.rstrip(os.sep)
+
+    new_dir = users_dir + ".new"
+    old_dir = users_dir + ".old"
+    write_user_shards(new_dir, new_shards, users)
+    meta_file = json_backend.repository.files["meta"][0]
+    meta = read_json(meta_file, {})
+    meta["user_shards"] = new_shards
+    os.replace(users_dir, old_dir)
+    os.replace(new_dir, users_dir)
+    write_file_atomic(meta_file, dump_json(meta))
+    for name in os.listdir(old_dir):
+        os.remove(os.path.join(old_dir, name))
+    os.rmdir(old_dir)
+    logging.info(f"Пользователи ({len(users)}) перераспределены: {json_backend.user_shards} -> {new_shards} шардов")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Инструменты хранилища бота")
+    parser.add_argument("--users", default="users.json", help="users.json прежних версий (без шардов)")
+    parser.add_argument("--users-dir", default="users")
+    parser.add_argument("--events", default="events.json")
+    parser.add_argument("--pending", default="photo.json")
+    parser.add_argument("--meta", default="meta.json")
+    parser.add_argument("--journal", default="journal.log")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="Перенести JSON хранилище в SQLite")
+    migrate_parser.add_argument("--db", default="bot.db")
+
+    reshard_parser = commands.add_parser("reshard", help="Изменить число шардов пользователей")
+    reshard_parser.add_argument("shards", type=int)
+
+    args = parser.parse_args()
+    json_backend = create_backend(
+        "json",
+        {"events": (args.events, list), "pending_events": (args.pending, list), "meta": (args.meta, dict)},
+        None, args.journal, users_dir=args.users_dir, users_file=args.users,
+        user_shards=read_json(args.meta, {}).get("user_shards", 16),
+    )
+    if args.command == "migrate":
+        migrate_json_to_sqlite(json_backend, args.db)
+    elif args.command == "reshard":
+        reshard_users(json_backend, args.shards)
@@ -1,34 +1,133 @@
 import logging
-import json
 import os
 import asyncio
 import re
 import datetime
-import requests
+import functools
+import hashlib
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from aiogram.filters import Command
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.filters import Command, CommandObject
+from ai_cache import AnswerCache
+from ai_client import AIClient, AIResponseError
+from ai_context import build_event_context
+from caches import LRUCache
+from callback_router import CallbackRouter
+from fsm_storage import create_fsm_storage
+from media_cache import MediaCache
+from notifications import NotificationQueue
+from progressive_reply import ProgressiveReply
+from rate_limiter import SendScheduler
+from reminders import ReminderScheduler
+from search import SearchIndex, event_document
+from webhook import run_webhook
+from storage import AsyncStorage, StaleVersionError, create_backend
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv()
 API_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес вебхука (без пути); если не задан, вебхук должен быть уже настроен
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Сколько секунд при остановке дообрабатывать уже принятые апдейты
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+# Другой сервер Bot API (локальный telegram-bot-api или fake_telegram.py для проверки под нагрузкой)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    bot = Bot(token=API_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=API_TOKEN)
+
+# users.json прежних версий; теперь пользователи хранятся по шардам в USERS_DIR
 USERS_FILE = 'users.json'
+USERS_DIR = 'users'
+USER_SHARDS = int(os.getenv("USER_SHARDS", "16"))
 EVENTS_FILE = 'events.json'
 PENDING_EVENTS_FILE = 'photo.json'
+META_FILE = 'meta.json'
+# Журнал изменений JSON хранилища: проигрывается поверх файлов при запуске
+JOURNAL_FILE = 'journal.log'
+DATABASE_FILE = os.getenv("DATABASE_FILE", "bot.db")
+# Архив прошедших мероприятий (JSON Lines) и как часто фоновая задача переносит их туда, в секундах
+ARCHIVE_FILE = 'events_archive.jsonl'
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+# Незавершённые рассылки участникам и их прогресс; сколько сообщений рассылки отправлять параллельно
+NOTIFICATIONS_DIR = 'notifications'
+NOTIFICATION_CONCURRENCY = int(os.getenv("NOTIFICATION_CONCURRENCY", "20"))
+# За сколько часов до мероприятия напоминать участникам; о каких мероприятиях уже напомнили
+REMINDER_HOURS = float(os.getenv("REMINDER_HOURS", "12"))
+REMINDERS_SENT_FILE = 'reminders_sent.json'
+# Тип хранилища: "json" (файлы users.json/events.json/photo.json) или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+# Где хранить состояния диалогов: "sqlite" (в DATABASE_FILE), "redis" (общие для нескольких
+# процессов бота, адрес в REDIS_URL) или "memory" (теряются при перезапуске)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+REDIS_URL = os.getenv("REDIS_URL")
+# Через сколько секунд без изменений незаконченный диалог считается брошенным
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+# Как часто удалять из базы брошенные диалоги, в секундах
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "3600"))
+# Сколько состояний диалогов держать в памяти, чтобы не читать базу на каждом апдейте
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1024"))
 MENU_IMAGE_PATH = 'photo.jpg'
+# file_id загруженных в Telegram картинок, чтобы не отправлять файл заново при каждом ответе
+MEDIA_CACHE_FILE = 'media_cache.json'
+# Сколько участников показывать в списке (подпись к фото ограничена 1024 символами)
+PARTICIPANTS_SHOWN = 20
+# Сколько мероприятий показывать на одной странице списка
+EVENTS_PAGE_SIZE = 5
+# Сколько построенных страниц списков мероприятий держать в кэше
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "1024"))
+# Сколько готовых подписей к мероприятиям держать в кэше
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", "2048"))
+# Для скольких пользователей помнить последний поисковый запрос (для перелистывания результатов)
+SEARCH_QUERIES_SIZE = int(os.getenv("SEARCH_QUERIES_SIZE", "4096"))
+# Как часто фоновая задача фиксирует журнал на диске и сколько максимум изменения могут ждать
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "0.2"))
+STORAGE_MAX_DIRTY_AGE = float(os.getenv("STORAGE_MAX_DIRTY_AGE", "1.0"))
+# После какого размера журнала (в байтах) файлы переписываются снимками, а журнал обрезается
+STORAGE_JOURNAL_MAX_BYTES = int(os.getenv("STORAGE_JOURNAL_MAX_BYTES", str(1024 * 1024)))
+# Размер пула потоков для блокирующих операций хранилища
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "4"))
+# Лимиты исходящих сообщений Bot API: всего в секунду, в личный чат в секунду (с запасом) и в группу
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
 AI_TOKEN = 4096
 AI_MODEL = "gpt-4o"
-AI_URL = "https://us-central1-chatgpt-c1cfb.cloudfunctions.net/callTurbo"
+# Адрес можно переопределить, например, чтобы проверить бота на локальной заглушке
+AI_URL = os.getenv("AI_URL", "https://us-central1-chatgpt-c1cfb.cloudfunctions.net/callTurbo")
+# Сколько соединений с AI API держать открытыми и сколько секунд ждать соединения и данных ответа
+AI_POOL_SIZE = int(os.getenv("AI_POOL_SIZE", "10"))
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", "10"))
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", "30"))
+# Кэш ответов AI на одинаковые вопросы: сколько ответов хранить, сколько секунд они актуальны
+# и файл, где они переживают перезапуск (пустое значение — не сохранять)
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "512"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", str(6 * 3600)))
+AI_CACHE_FILE = os.getenv("AI_CACHE_FILE", "ai_cache.json")
+# Сколько мероприятий, подходящих к вопросу, и сколько ближайших по дате показывать AI
+# и сколько токенов подсказки на них отводить
+AI_CONTEXT_TOP_K = int(os.getenv("AI_CONTEXT_TOP_K", "8"))
+AI_CONTEXT_UPCOMING = int(os.getenv("AI_CONTEXT_UPCOMING", "5"))
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "1500"))
+# Показывать ответ AI по мере генерации (если AI API умеет отдавать поток) и как часто
+# дописывать сообщение с ответом, в секундах
+AI_STREAM = os.getenv("AI_STREAM", "0") == "1"
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0"))
+# Заголовок Host aiohttp подставляет сам по AI_URL
 AI_HEADERS = {
-    "Host": "us-central1-chatgpt-c1cfb.cloudfunctions.net",
     "accept": "/",
     "content-type": "application/json",
     "user-agent": "AI Chatbot/3.6 (com.highteqsolutions.chatgpt; build:8; iOS 16.7.2) Alamofire/5.9.1",
@@ -46,28 +145,40 @@ EVENT_TYPES = {
     "other": {"name": "Другое", "emoji": "🔍"}
 }
 
+# Списки по дате проведения: показываются рядом с категориями и листаются так же
+DATE_LISTS = {
+    "upcoming": {"name": "Ближайшие", "emoji": "⏭️"},
+    "week": {"name": "На этой неделе", "emoji": "📆"},
+}
 
-async def get_ai_response(user_message, ai_context="", max_retries=3, timeout=30):
-    current_message = f"\nUser: {user_message}"
 
+AI_FALLBACK_ANSWER = "Извините, не удалось получить ответ от ИИ."
+
+
+def ai_request_data(user_message, ai_context="", events_context="", stream=False):
+    events_part = f"МЕРОПРИЯТИЯ, ИЗ КОТОРЫХ МОЖНО СОВЕТОВАТЬ:\n{events_context}\n\n" if events_context else ""
     data = {
         'max_tokens': AI_TOKEN,
-        'responseType': 'normal',
+        'responseType': 'stream' if stream else 'normal',
         'osType': 'iOS',
         'model': AI_MODEL,
-        'value': f"ПРОШЛЫЕ СООБЩЕНИЯ: {ai_context}{current_message}",
+        'value': f"{events_part}ПРОШЛЫЕ СООБЩЕНИЯ: {ai_context}\nUser: {user_message}",
         'search': user_message
     }
+    if stream:
+        data['stream'] = True
+    return data
+
+
+async def get_ai_response(user_message, ai_context="", max_retries=3, events_context=""):
+    current_message = f"\nUser: {user_message}"
+    data = ai_request_data(user_message, ai_context, events_context)
 
     for attempt in range(max_retries):
         try:
-            response = await asyncio.to_thread(
-                lambda: requests.post(AI_URL, headers=AI_HEADERS,
-                                      data=json.dumps(data), timeout=timeout)
-            )
+            status, response_data = await ai_client.post_json(data)
 
-            if response.status_code == 200:
-                response_data = response.json()
+            if status == 200:
                 content = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
 
                 if content:
@@ -75,7 +186,7 @@ async def get_ai_response(user_message, ai_context="", max_retries=3, timeout=30
                 else:
                     logging.warning("Пустой ответ от AI")
             else:
-                logging.error(f"Ошибка AI API: {response.status_code}")
+                logging.error(f"Ошибка AI API: {status}")
 
             # Пауза перед повторной попыткой
             if attempt < max_retries - 1:
@@ -86,37 +197,139 @@ async def get_ai_response(user_message, ai_context="", max_retries=3, timeout=30
             if attempt < max_retries - 1:
                 await asyncio.sleep(1)
 
-    return "Извините, не удалось получить ответ от ИИ.", ai_context
+    return AI_FALLBACK_ANSWER, ai_context
+
+
+# Хранилище открывается один раз в main(); JSON коллекции при этом целиком живут в памяти,
+# а всё блокирующее выполняется в пуле потоков, чтобы не останавливать polling
+storage = AsyncStorage(create_backend(
+    STORAGE_BACKEND,
+    {
+        "events": (EVENTS_FILE, list),
+        "pending_events": (PENDING_EVENTS_FILE, list),
+        "meta": (META_FILE, dict),
+    },
+    DATABASE_FILE,
+    JOURNAL_FILE,
+    users_dir=USERS_DIR,
+    user_shards=USER_SHARDS,
+    users_file=USERS_FILE,
+    flush_interval=STORAGE_FLUSH_INTERVAL,
+    max_dirty_age=STORAGE_MAX_DIRTY_AGE,
+    journal_max_bytes=STORAGE_JOURNAL_MAX_BYTES,
+    archive_file=ARCHIVE_FILE,
+), max_workers=STORAGE_THREADS)
+# Состояния диалогов (регистрация, создание и редактирование мероприятий) переживают перезапуск
+fsm_storage = create_fsm_storage(FSM_STORAGE, DATABASE_FILE, ttl=FSM_STATE_TTL,
+                                 cache_size=FSM_CACHE_SIZE, redis_url=REDIS_URL)
+dp = Dispatcher(storage=fsm_storage)
+# Нажатия на inline кнопки: callback_data разбирается один раз и по префиксному дереву
+# уходит в обработчик, зарегистрированный через @callbacks.route
+callbacks = CallbackRouter()
+# Все запросы бота в чаты проходят через планировщик с ограничением скорости
+send_scheduler = SendScheduler(SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE)
+bot.session.middleware(send_scheduler)
+# Запросы к AI идут через общий пул соединений; сессия открывается в main()
+ai_client = AIClient(AI_URL, AI_HEADERS, AI_POOL_SIZE, AI_CONNECT_TIMEOUT, AI_READ_TIMEOUT)
+ai_answer_cache = AnswerCache(AI_CACHE_SIZE, AI_CACHE_TTL, AI_CACHE_FILE or None)
+notifications = NotificationQueue(NOTIFICATIONS_DIR, bot, NOTIFICATION_CONCURRENCY)
+media_cache = MediaCache(MEDIA_CACHE_FILE)
+# Страницы списков мероприятий по ключу с версией каталога/пользователя из storage
+keyboard_cache = LRUCache(KEYBOARD_CACHE_SIZE)
+# Подписи мероприятий: (id, show_creator, include_links) -> (версия мероприятия, текст)
+caption_cache = LRUCache(CAPTION_CACHE_SIZE)
+# Полнотекстовый индекс по названию, описанию и месту; строится при запуске и обновляется при изменениях
+search_index = SearchIndex()
+# user_id -> последний запрос /search; не в данных FSM, чтобы не смешиваться с регистрацией и созданием мероприятий
+search_queries = LRUCache(SEARCH_QUERIES_SIZE)
+
+
+async def answer_menu_photo(message, **kwargs):
+    """Отвечает картинкой меню; после первой загрузки отправляется только её file_id."""
+    return await media_cache.answer_photo(message, MENU_IMAGE_PATH, **kwargs)
+
+
+async def ask_ai(question):
+    """Ответ AI на вопрос о мероприятиях; одинаковые вопросы при неизменном каталоге берутся из кэша."""
+    async def ask(question):
+        answer, _ = await get_ai_response(question, events_context=await get_event_context(question))
+        # Неудачу не кэшируем: следующий вопрос попробует ещё раз
+        return None if answer == AI_FALLBACK_ANSWER else answer
+
+    answer = await ai_answer_cache.get_or_ask(question, ai_cache_version(), ask)
+    return answer or AI_FALLBACK_ANSWER
+
+
+async def stream_ai_response(user_message, events_context="", max_retries=3):
+    """Потоковый вариант get_ai_response: отдаёт порции ответа по мере генерации.
+
+    Повторяет запрос, только пока не пришло ни одной порции; обрыв посреди ответа
+    пробрасывается, потому что уже показанный текст повторить нельзя.
+    """
+    data = ai_request_data(user_message, events_context=events_context, stream=True)
+    for attempt in range(max_retries):
+        received = False
+        try:
+            async for chunk in ai_client.stream(data):
+                received = True
+                yield chunk
+            if received:
+                return
+            logging.warning("Пустой ответ от AI")
+        except Exception as e:
+            if received:
+                raise
+            if isinstance(e, AIResponseError):
+                logging.error(f"Ошибка AI API: {e.status}")
+            else:
+                logging.error(f"Ошибка при запросе к AI: {e}")
+        if attempt < max_retries - 1:
+            await asyncio.sleep(1)
 
 
-def load_data(filename):
-    """Универсальная функция загрузки данных из JSON файла."""
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        default_data = [] if filename in [EVENTS_FILE, PENDING_EVENTS_FILE] else {}
-        save_data(filename, default_data)
-        return default_data
-    except json.JSONDecodeError:
-        logging.error(f"Ошибка декодирования JSON в файле {filename}")
-        return [] if filename in [EVENTS_FILE, PENDING_EVENTS_FILE] else {}
-
-def get_event_context():
+async def stream_ai_answer(question):
+    """Накопленный текст ответа AI по мере генерации; ответ из кэша отдаётся сразу целиком."""
+    version = ai_cache_version()
+    answer = ai_answer_cache.get(question, version)
+    if answer is not None:
+        yield answer
+        return
+    text = ""
     try:
-        with open(EVENTS_FILE, 'r', encoding='utf-8') as f:
-            events = json.load(f)
-            descriptions = [f"Название: {e.get('name','Без названия')}\nОписание: {e.get('description','Без описания')}" for e in events]
-            return "\n---\n".join(descriptions)
+        async for chunk in stream_ai_response(question, events_context=await get_event_context(question)):
+            text += chunk
+            yield text
     except Exception as e:
-        logging.error(f"Ошибка при загрузке мероприятий: {e}")
-        return ""
+        logging.error(f"Ответ AI прервался: {e}")
+        # Оборванный ответ не кэшируем
+        yield f"{text}…\n\n⚠️ Ответ прервался, спросите ещё раз." if text else AI_FALLBACK_ANSWER
+        return
+    if not text:
+        yield AI_FALLBACK_ANSWER
+        return
+    ai_answer_cache.put(question, version, text)
 
 
-def save_data(filename, data):
-    """Универсальная функция сохранения данных в JSON файл."""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def ai_cache_version():
+    # Ответ зависит от каталога и, через ближайшие мероприятия, от текущей даты
+    return storage.catalog_version, datetime.date.today().isoformat()
+
+
+async def catalog_fingerprint():
+    """Отпечаток каталога по id и версиям мероприятий (и дате): меняется при любом изменении каталога."""
+    digest = hashlib.sha1(datetime.date.today().isoformat().encode())
+    for event_id, event in await load_events():
+        digest.update(f"{event_id}:{event.get('version', 0)};".encode())
+    return digest.hexdigest()
+
+
+async def get_event_context(question):
+    """Мероприятия для подсказки AI: лучшие по BM25 для вопроса и ближайшие, в пределах бюджета токенов."""
+    relevant = [(event_id, await get_event(event_id))
+                for event_id, _ in search_index.search(question, limit=AI_CONTEXT_TOP_K)]
+    start, _ = date_list_range("upcoming", datetime.date.today())
+    upcoming, _ = await storage.events_between(start, None, 0, AI_CONTEXT_UPCOMING)
+    return build_event_context(relevant, upcoming, AI_CONTEXT_TOKEN_BUDGET)
 
 def is_alpha(text: str) -> bool:
     # Разрешаем только буквы (латиница и кириллица) и пробелы
@@ -136,75 +349,133 @@ def is_valid_date(date_text):
         return False
 
 
-def ensure_files_exist():
-    """Проверяет существование необходимых файлов и создаёт их при необходимости."""
-    files_templates = {
-        USERS_FILE: {},
-        EVENTS_FILE: [],
-        PENDING_EVENTS_FILE: []
-    }
+async def get_user(user_id):
+    return await storage.get_user(user_id)
 
-    for file, template in files_templates.items():
-        if not os.path.exists(file):
-            save_data(file, template)
 
+async def save_user(user_id, user_data):
+    await storage.save_user(user_id, user_data)
 
-def load_users():
-    return load_data(USERS_FILE)
 
+async def load_events():
+    """Возвращает список пар (id мероприятия, мероприятие)."""
+    return await storage.list_events()
 
-def save_user(user_id, user_data):
-    users = load_users()
-    users[user_id] = user_data
-    save_data(USERS_FILE, users)
 
+async def get_event(event_id):
+    return await storage.get_event(event_id)
 
-def load_events():
-    return load_data(EVENTS_FILE)
 
+async def save_event(event_data):
+    event_id = await storage.add_event(event_data)
+    search_index.add(event_id, event_document(event_data))
+    reminders.schedule(event_id, event_data)
+    return event_id
 
-def save_event(event_data):
-    events = load_events()
-    events.append(event_data)
-    save_data(EVENTS_FILE, events)
 
+async def update_event(event_id, fields, expected_version=None):
+    updated = await storage.update_event(event_id, fields, expected_version)
+    if updated:
+        event = await get_event(event_id)
+        if event is not None:
+            search_index.add(event_id, event_document(event))
+            reminders.schedule(event_id, event)
+    return updated
 
-def load_pending_events():
-    return load_data(PENDING_EVENTS_FILE)
 
+async def archive_past_events():
+    """Фоновая задача: переносит мероприятия прошедших дней в архив, чтобы рабочие данные не росли."""
+    while True:
+        before = datetime.datetime.combine(datetime.date.today(), datetime.time()).isoformat(timespec="minutes")
+        try:
+            archived = await storage.archive_events(before)
+        except Exception as e:
+            logging.error(f"Ошибка при архивировании прошедших мероприятий: {e}")
+        else:
+            for event_id in archived:
+                invalidate_event_caption(event_id)
+                search_index.remove(event_id)
+                reminders.cancel(event_id)
+            if archived:
+                logging.info(f"В архив перенесено прошедших мероприятий: {len(archived)}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+async def purge_abandoned_states():
+    """Фоновая задача: удаляет диалоги, брошенные дольше FSM_STATE_TTL назад (Redis делает это сам)."""
+    if not hasattr(fsm_storage, "purge_expired"):
+        return
+    while True:
+        try:
+            purged = await fsm_storage.purge_expired()
+        except Exception as e:
+            logging.error(f"Ошибка при удалении брошенных диалогов: {e}")
+        else:
+            if purged:
+                logging.info(f"Удалено брошенных диалогов: {purged}")
+        await asyncio.sleep(FSM_PURGE_INTERVAL)
 
-def save_pending_event(event_data):
-    events = load_pending_events()
-    events.append(event_data)
-    save_data(PENDING_EVENTS_FILE, events)
 
+async def notify_participants(participant_ids, text, except_user_id=None):
+    """Ставит рассылку участникам в фоновую очередь; обработчик её не ждёт."""
+    await notifications.submit((uid for uid in participant_ids if uid != except_user_id), text)
 
-def remove_pending_event(event_idx):
-    events = load_pending_events()
-    if 0 <= event_idx < len(events):
-        removed_event = events.pop(event_idx)
-        save_data(PENDING_EVENTS_FILE, events)
-        return removed_event
-    return None
 
+async def send_event_reminder(event_id):
+    event = await get_event(event_id)
+    if event is None:
+        return
+    await notify_participants(
+        await storage.participant_ids(event_id),
+        f"⏰ Напоминание: «{event['name']}» — {event['time']}, {event['location']}."
+    )
 
-def register_user_for_event(user_id, event_idx):
-    users = load_users()
-    if user_id not in users:
-        return False
 
-    if "registered_events" not in users[user_id]:
-        users[user_id]["registered_events"] = []
+reminders = ReminderScheduler(REMINDER_HOURS, REMINDERS_SENT_FILE, send_event_reminder)
+
+
+async def build_search_index():
+    for event_id, event in await load_events():
+        search_index.add(event_id, event_document(event))
+    logging.info(f"Поисковый индекс построен: мероприятий {len(search_index)}")
+
+
+async def load_pending_events():
+    return await storage.list_pending()
+
+
+async def save_pending_event(event_data):
+    await storage.add_pending(event_data)
+
+
+async def remove_pending_event(pending_idx):
+    return await storage.remove_pending(pending_idx)
+
+
+async def register_user_for_event(user_id, event_id):
+    return await storage.register(user_id, event_id)
 
-    if event_idx not in users[user_id]["registered_events"]:
-        users[user_id]["registered_events"].append(event_idx)
-        save_data(USERS_FILE, users)
-        return True
-    return False
 
+async def get_user_registrations(user_id):
+    return await storage.user_registrations(user_id)
 
-def format_event_caption(event, show_creator=True, include_links=True):
+
+def format_event_caption(event, show_creator=True, include_links=True, participants_count=None):
     """Форматирует текст с информацией о событии для отображения пользователю"""
+    # Число участников меняется чаще самого мероприятия, поэтому в кэш не попадает
+    caption = _event_caption_body(event, show_creator, include_links)
+    if participants_count is not None:
+        caption += f"\n👥 **Участников:** {participants_count}"
+    return caption
+
+
+def _event_caption_body(event, show_creator, include_links):
+    cache_key = (event.get("id"), show_creator, include_links)
+    revision = event.get("version", 0)
+    cached = caption_cache.get(cache_key)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+
     category = event.get("category", "unknown")
     category_emoji = EVENT_TYPES.get(category, {}).get("emoji", "🔍")
     category_name = EVENT_TYPES.get(category, {}).get("name", "Без категории")
@@ -230,10 +501,24 @@ def format_event_caption(event, show_creator=True, include_links=True):
         f"📍 **Место:** {event['location']}\n"
         f"🏷️ **Тип:** {category_emoji} {category_name}{links_info}{creator_info}"
     )
+    if cache_key[0] is not None:
+        caption_cache.put(cache_key, (revision, caption))
     return caption
 
 
+def invalidate_event_caption(event_id):
+    for show_creator in (True, False):
+        for include_links in (True, False):
+            caption_cache.pop((event_id, show_creator, include_links))
+
+
 def get_main_menu(user_id=None):
+    # Меню одинаковое для всех пользователей
+    return _main_menu()
+
+
+@functools.cache
+def _main_menu():
     keyboard_buttons = [
         [InlineKeyboardButton(text="🎭 Мероприятия", callback_data="view_events")],
         [InlineKeyboardButton(text="📅 Мои мероприятия", callback_data="my_events")],
@@ -243,10 +528,16 @@ def get_main_menu(user_id=None):
     return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
 
+@functools.cache
 def get_event_categories():
     """Создаёт клавиатуру со всеми категориями мероприятий"""
     keyboard = []
 
+    for key, value in DATE_LISTS.items():
+        keyboard.append([
+            InlineKeyboardButton(text=f"{value['emoji']} {value['name']}", callback_data=f"category_{key}")
+        ])
+
     # Добавляем все категории из EVENT_TYPES
     for key, value in EVENT_TYPES.items():
         keyboard.append([
@@ -270,6 +561,7 @@ def get_event_categories():
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+@functools.cache
 def get_recommendations_menu():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🤖 Посоветоваться с ИИ", callback_data="consult_ai")],
@@ -278,6 +570,7 @@ def get_recommendations_menu():
     return keyboard
 
 
+@functools.cache
 def get_end_consultation_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔚 Завершить консультацию", callback_data="end_consultation")]
@@ -285,85 +578,83 @@ def get_end_consultation_keyboard():
     return keyboard
 
 
-def get_events_list(category, page=0):
-    events = load_events()
-    if category != "all":
-        events = [e for e in events if e.get("category") == category]
+def date_list_range(category, today):
+    """Границы [начало, конец) списка по дате в формате дат хранилища; конец None — без ограничения."""
+    start = datetime.datetime.combine(today, datetime.time())
+    if category == "week":
+        end = start + datetime.timedelta(days=7 - today.weekday())
+        return start.isoformat(timespec="minutes"), end.isoformat(timespec="minutes")
+    return start.isoformat(timespec="minutes"), None
+
+
+async def get_events_list(category, page=0):
+    today = datetime.date.today()
+    # Версия берётся до чтения: если каталог изменится во время построения, страница уйдёт под старым ключом
+    cache_key = ("events", category, page, storage.catalog_version, today)
+    keyboard = keyboard_cache.get(cache_key)
+    if keyboard is not None:
+        return keyboard
+
+    # Индекс категории (или дат) отдаёт сразу нужную страницу и общее число мероприятий
+    start_idx = page * EVENTS_PAGE_SIZE
+    if category in DATE_LISTS:
+        start, end = date_list_range(category, today)
+        events, total = await storage.events_between(start, end, start_idx, EVENTS_PAGE_SIZE)
+    else:
+        events, total = await storage.events_page(category, start_idx, EVENTS_PAGE_SIZE)
+    end_idx = start_idx + len(events)
+    pages_count = max(1, -(-total // EVENTS_PAGE_SIZE))
 
     keyboard_buttons = []
-    start_idx = page * 5
-    end_idx = min(start_idx + 5, len(events))
-
-    for i in range(start_idx, end_idx):
-        event = events[i]
-        category = event.get("category", "unknown")
-        category_emoji = EVENT_TYPES.get(category, {}).get("emoji", "🔍")
+    for event_id, event in events:
+        event_category = event.get("category", "unknown")
+        category_emoji = EVENT_TYPES.get(event_category, {}).get("emoji", "🔍")
 
         keyboard_buttons.append([
-            InlineKeyboardButton(text=f"{category_emoji} {event['name']}", callback_data=f"event_{i}")
+            InlineKeyboardButton(text=f"{category_emoji} {event['name']}", callback_data=f"event_{event_id}")
         ])
 
     nav_buttons = []
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page_{category}_{page - 1}"))
-    if end_idx < len(events):
+    if pages_count > 1:
+        nav_buttons.append(InlineKeyboardButton(text=f"📄 {page + 1} из {pages_count}", callback_data="none"))
+    if end_idx < total:
         nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"page_{category}_{page + 1}"))
 
     if nav_buttons:
         keyboard_buttons.append(nav_buttons)
 
     keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад к категориям", callback_data="back_to_categories")])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    keyboard_cache.put(cache_key, keyboard)
+    return keyboard
+
 
+async def get_my_events_list(user_id, page=0):
+    # Названия мероприятий меняются вместе с каталогом, состав списка — вместе с пользователем
+    cache_key = ("my_events", user_id, page, storage.user_version(user_id), storage.catalog_version)
+    keyboard = keyboard_cache.get(cache_key)
+    if keyboard is not None:
+        return keyboard
 
-def get_my_events_list(user_id, page=0):
-    users = load_users()
-    events = load_events()
-
-    # Список зарегистрированных мероприятий
-    registered_events = []
-    if user_id in users and "registered_events" in users[user_id]:
-        for event_idx in users[user_id]["registered_events"]:
-            if event_idx < len(events):
-                event = events[event_idx]
-                registered_events.append({
-                    "index": event_idx,
-                    "event": event,
-                    "is_creator": event.get("creator_id") == user_id,
-                    "is_registered": True
-                })
-
-    # Добавляем созданные пользователем мероприятия, если они еще не в списке
-    created_events = []
-    for event_idx, event in enumerate(events):
-        if event.get("creator_id") == user_id and not any(r.get("index") == event_idx for r in registered_events):
-            created_events.append({
-                "index": event_idx,
-                "event": event,
-                "is_creator": True,
-                "is_registered": False
-            })
-
-    # Объединяем списки и сортируем по времени (если есть)
-    all_user_events = registered_events + created_events
+    # Индекс пользователя отдаёт созданные им мероприятия и его регистрации, уже отсортированные по дате
+    all_user_events = await storage.user_events(user_id)
 
     keyboard_buttons = []
     start_idx = page * 5
     end_idx = min(start_idx + 5, len(all_user_events))
 
-    for i in range(start_idx, end_idx):
-        event_data = all_user_events[i]
-        event = event_data["event"]
-        event_idx = event_data["index"]
+    for event_id, event in all_user_events[start_idx:end_idx]:
         category = event.get("category", "unknown")
         category_emoji = EVENT_TYPES.get(category, {}).get("emoji", "🔍")
 
         # Добавляем специальную метку для созданных мероприятий
-        prefix = "👑 " if event_data["is_creator"] else ""
+        prefix = "👑 " if event.get("creator_id") == user_id else ""
 
         keyboard_buttons.append([
             InlineKeyboardButton(text=f"{prefix}{category_emoji} {event['name']}",
-                                 callback_data=f"my_event_{event_idx}")
+                                 callback_data=f"my_event_{event_id}")
         ])
 
     nav_buttons = []
@@ -376,7 +667,41 @@ def get_my_events_list(user_id, page=0):
         keyboard_buttons.append(nav_buttons)
 
     keyboard_buttons.append([InlineKeyboardButton(text="🏠 Назад в меню", callback_data="back_to_main")])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    keyboard_cache.put(cache_key, keyboard)
+    return keyboard
+
+
+async def get_search_results(query, page=0):
+    """Страница результатов поиска в том же виде, что и список мероприятий категории."""
+    results = search_index.search(query)
+    start_idx = page * EVENTS_PAGE_SIZE
+    end_idx = min(start_idx + EVENTS_PAGE_SIZE, len(results))
+    pages_count = max(1, -(-len(results) // EVENTS_PAGE_SIZE))
+
+    keyboard_buttons = []
+    for event_id, _ in results[start_idx:end_idx]:
+        event = await get_event(event_id)
+        if event is None:
+            continue
+        category_emoji = EVENT_TYPES.get(event.get("category", "unknown"), {}).get("emoji", "🔍")
+        keyboard_buttons.append([
+            InlineKeyboardButton(text=f"{category_emoji} {event['name']}", callback_data=f"event_{event_id}")
+        ])
+
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"search_page_{page - 1}"))
+    if pages_count > 1:
+        nav_buttons.append(InlineKeyboardButton(text=f"📄 {page + 1} из {pages_count}", callback_data="none"))
+    if end_idx < len(results):
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"search_page_{page + 1}"))
+
+    if nav_buttons:
+        keyboard_buttons.append(nav_buttons)
+
+    keyboard_buttons.append([InlineKeyboardButton(text="🏠 Назад в меню", callback_data="back_to_main")])
+    return len(results), InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
 
 class RegistrationStates(StatesGroup):
@@ -399,7 +724,7 @@ class AIConsultationStates(StatesGroup):
     waiting_for_question = State()
 
 class EventEditStates(StatesGroup):
-    event_idx = State()
+    event_id = State()
     name = State()
     description = State()
     location = State()
@@ -409,15 +734,19 @@ class EventEditStates(StatesGroup):
     category = State()
 
 
+@dp.callback_query()
+async def route_callback(callback_query: types.CallbackQuery, state: FSMContext):
+    await callbacks.dispatch(callback_query, state)
+
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     user_id = str(message.from_user.id)
-    users = load_users()
+    user = await get_user(user_id)
 
-    if user_id in users:
-        await message.answer_photo(
-            photo=FSInputFile(MENU_IMAGE_PATH),
-            caption=f"👋 Добро пожаловать обратно, {users[user_id]['name']}!",
+    if user:
+        await answer_menu_photo(message,
+            caption=f"👋 Добро пожаловать обратно, {user['name']}!",
             reply_markup=get_main_menu(user_id)
         )
     else:
@@ -425,6 +754,25 @@ async def cmd_start(message: types.Message, state: FSMContext):
         await state.set_state(RegistrationStates.name)
 
 
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔎 Напишите, что искать, после команды, например: /search настольные игры")
+        return
+
+    found, keyboard = await get_search_results(query)
+    if not found:
+        await message.answer(f"😕 По запросу «{query}» ничего не найдено")
+        return
+    # Запрос нужен для перелистывания, а в callback_data он может не поместиться
+    search_queries.put(message.from_user.id, query)
+    await answer_menu_photo(message,
+        caption=f"🔎 Результаты поиска «{query}»: найдено {found}",
+        reply_markup=keyboard
+    )
+
+
 @dp.message(RegistrationStates.name)
 async def process_name(message: types.Message, state: FSMContext):
     name = message.text.strip()
@@ -449,57 +797,53 @@ async def process_faculty(message: types.Message, state: FSMContext):
         "active_event_creations": 0
     })
     uid = str(message.from_user.id)
-    save_user(uid, data)
-    await message.answer_photo(photo=FSInputFile(MENU_IMAGE_PATH),
-                               caption=f"✅ Регистрация завершена! Добро пожаловать, {data['name']}!",
-                               reply_markup=get_main_menu(uid))
+    await save_user(uid, data)
+    await answer_menu_photo(message,
+                            caption=f"✅ Регистрация завершена! Добро пожаловать, {data['name']}!",
+                            reply_markup=get_main_menu(uid))
     await state.clear()
 
-@dp.callback_query(lambda c: c.data.startswith("pending_page_"))
-async def process_pending_page(callback_query: types.CallbackQuery):
+@callbacks.route("page", str, int)
+async def process_page(callback_query: types.CallbackQuery, category: str, page: int):
     await callback_query.answer()
-    page = int(callback_query.data.split("_")[2])
     await callback_query.message.edit_reply_markup(
-        reply_markup=get_pending_events_list(page)
+        reply_markup=await get_events_list(category, page)
     )
 
 
-@dp.callback_query(lambda c: c.data.startswith("page_"))
-async def process_page(callback_query: types.CallbackQuery):
+@callbacks.route("search_page", int)
+async def process_search_page(callback_query: types.CallbackQuery, page: int):
+    query = search_queries.get(callback_query.from_user.id)
+    if not query:
+        await callback_query.answer("⚠️ Поиск устарел, повторите команду /search")
+        return
     await callback_query.answer()
-    _, category, page = callback_query.data.split("_")
-    page = int(page)
-    await callback_query.message.edit_reply_markup(
-        reply_markup=get_events_list(category, page)
-    )
+    _, keyboard = await get_search_results(query, page)
+    await callback_query.message.edit_reply_markup(reply_markup=keyboard)
 
 
-@dp.callback_query(lambda c: c.data.startswith("my_page_"))
-async def process_my_page(callback_query: types.CallbackQuery):
+@callbacks.route("my_page", int)
+async def process_my_page(callback_query: types.CallbackQuery, page: int):
     await callback_query.answer()
-    page = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
     await callback_query.message.edit_reply_markup(
-        reply_markup=get_my_events_list(user_id, page)
+        reply_markup=await get_my_events_list(user_id, page)
     )
 
 
-@dp.callback_query(lambda c: c.data.startswith("event_") and c.data.split("_")[1].isdigit())
-async def process_event(callback_query: types.CallbackQuery):
+@callbacks.route("event", int)
+async def process_event(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[1])
     user_id = str(callback_query.from_user.id)
-    events = load_events()
+    event = await get_event(event_id)
 
-    if event_idx >= len(events):
+    if event is None:
         await callback_query.message.edit_caption(
             caption="⚠️ Мероприятие не найдено",
             reply_markup=get_event_categories()
         )
         return
 
-    event = events[event_idx]
-
     # Проверяем, является ли пользователь создателем мероприятия
     is_creator = event.get("creator_id") == user_id
 
@@ -508,12 +852,13 @@ async def process_event(callback_query: types.CallbackQuery):
         keyboard_buttons.append([InlineKeyboardButton(text="👑 Вы создатель этого мероприятия", callback_data="none")])
     else:
         keyboard_buttons.append(
-            [InlineKeyboardButton(text="✅ Зарегистрироваться", callback_data=f"register_for_event_{event_idx}")])
+            [InlineKeyboardButton(text="✅ Зарегистрироваться", callback_data=f"register_for_event_{event_id}")])
 
     keyboard_buttons.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data="back_to_events")])
     keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-    caption = format_event_caption(event, show_creator=True)
+    caption = format_event_caption(event, show_creator=True,
+                                   participants_count=await get_participants_count(event_id))
 
     try:
         await callback_query.message.edit_caption(
@@ -523,8 +868,7 @@ async def process_event(callback_query: types.CallbackQuery):
         )
     except Exception as e:
         logging.error(f"Ошибка при редактировании сообщения: {e}")
-        await callback_query.message.answer_photo(
-            photo=FSInputFile(MENU_IMAGE_PATH),
+        await answer_menu_photo(callback_query.message,
             caption=caption,
             reply_markup=keyboard,
             parse_mode="Markdown"
@@ -532,51 +876,47 @@ async def process_event(callback_query: types.CallbackQuery):
 
 
 # Обновляем обработчик просмотра своего мероприятия, добавляя кнопку удаления
-@dp.callback_query(lambda c: c.data.startswith("my_event_"))
-async def process_my_event(callback_query: types.CallbackQuery):
+@callbacks.route("my_event", int)
+async def process_my_event(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
-    events = load_events()
+    event = await get_event(event_id)
 
-    if event_idx >= len(events):
+    if event is None:
         await callback_query.message.edit_caption(
             caption="⚠️ Мероприятие не найдено",
             reply_markup=get_main_menu()
         )
         return
 
-    event = events[event_idx]
     is_creator = event.get("creator_id") == user_id
 
     # Проверяем, зарегистрирован ли пользователь на мероприятие
-    users = load_users()
-    is_registered = False
-    if user_id in users and "registered_events" in users[user_id]:
-        is_registered = event_idx in users[user_id]["registered_events"]
+    is_registered = event_id in await get_user_registrations(user_id)
 
     # Различные кнопки для создателя и участника
     keyboard_buttons = []
     if is_creator:
         keyboard_buttons.append(
-            [InlineKeyboardButton(text="👑 Вы создатель этого мероприятия", callback_data=f"creator_info_{event_idx}")])
+            [InlineKeyboardButton(text="👑 Вы создатель этого мероприятия", callback_data=f"creator_info_{event_id}")])
         keyboard_buttons.append([InlineKeyboardButton(text="✏️ Редактировать мероприятие",
-                                                      callback_data=f"edit_event_{event_idx}")])
+                                                      callback_data=f"edit_event_{event_id}")])
         keyboard_buttons.append([InlineKeyboardButton(text="👥 Список участников",
-                                                      callback_data=f"view_participants_{event_idx}")])
+                                                      callback_data=f"view_participants_{event_id}")])
         # Добавляем кнопку удаления для создателя
         keyboard_buttons.append([InlineKeyboardButton(text="🗑️ Удалить мероприятие",
-                                                      callback_data=f"delete_event_{event_idx}")])
+                                                      callback_data=f"delete_event_{event_id}")])
     # Добавляем кнопку отмены регистрации для обычных пользователей
     elif is_registered:
         keyboard_buttons.append([InlineKeyboardButton(text="❌ Отменить регистрацию",
-                                                      callback_data=f"cancel_registration_{event_idx}")])
+                                                      callback_data=f"cancel_registration_{event_id}")])
 
     keyboard_buttons.append([InlineKeyboardButton(text="📅 Назад к моим мероприятиям", callback_data="my_events")])
     keyboard_buttons.append([InlineKeyboardButton(text="🏠 Назад в меню", callback_data="back_to_main")])
     keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-    caption = format_event_caption(event, show_creator=True)
+    caption = format_event_caption(event, show_creator=True,
+                                   participants_count=await get_participants_count(event_id))
 
     try:
         await callback_query.message.edit_caption(
@@ -586,13 +926,12 @@ async def process_my_event(callback_query: types.CallbackQuery):
         )
     except Exception as e:
         logging.error(f"Ошибка при редактировании сообщения: {e}")
-        await callback_query.message.answer_photo(
-            photo=FSInputFile(MENU_IMAGE_PATH),
+        await answer_menu_photo(callback_query.message,
             caption=caption,
             reply_markup=keyboard,
             parse_mode="Markdown"
         )
-@dp.callback_query(lambda c: c.data == "consult_ai")
+@callbacks.route("consult_ai")
 async def consult_ai_handler(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
     await callback_query.message.answer("🧠 Напиши, что ты хочешь узнать, и AI подскажет мероприятие")
@@ -601,26 +940,30 @@ async def consult_ai_handler(callback_query: types.CallbackQuery, state: FSMCont
 @dp.message(AIConsultationStates.waiting_for_question)
 async def process_ai_question(message: types.Message, state: FSMContext):
     question = message.text.strip()
-    await message.answer("💬 Думаю... Подожди секунду...")
-    answer, _ = await get_ai_response(question)
-    await message.answer(f"🤖 {answer}")
+    thinking = await message.answer("💬 Думаю... Подожди секунду...")
+    if AI_STREAM:
+        # Ответ дописывается в сообщение «Думаю...» по мере генерации
+        reply = ProgressiveReply(thinking, AI_STREAM_EDIT_INTERVAL, prefix="🤖 ")
+        async for text in stream_ai_answer(question):
+            await reply.update(text)
+        await reply.finish()
+    else:
+        answer = await ask_ai(question)
+        await message.answer(f"🤖 {answer}")
     await state.clear()
 
 
 # Обработчик нажатия на кнопку удаления (запрос подтверждения)
-@dp.callback_query(lambda c: c.data.startswith("delete_event_"))
-async def confirm_delete_event(callback_query: types.CallbackQuery):
+@callbacks.route("delete_event", int)
+async def confirm_delete_event(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
 
-    events = load_events()
-    if event_idx >= len(events):
+    event = await get_event(event_id)
+    if event is None:
         await callback_query.message.answer("⚠️ Мероприятие не найдено")
         return
 
-    event = events[event_idx]
-
     # Проверяем, является ли пользователь создателем
     if event.get("creator_id") != user_id:
         await callback_query.message.answer("⚠️ Только создатель мероприятия может удалить его")
@@ -629,8 +972,8 @@ async def confirm_delete_event(callback_query: types.CallbackQuery):
     # Формируем клавиатуру для подтверждения
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"confirm_delete_{event_idx}"),
-            InlineKeyboardButton(text="❌ Нет, отмена", callback_data=f"my_event_{event_idx}")
+            InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"confirm_delete_{event_id}"),
+            InlineKeyboardButton(text="❌ Нет, отмена", callback_data=f"my_event_{event_id}")
         ]
     ])
 
@@ -642,31 +985,34 @@ async def confirm_delete_event(callback_query: types.CallbackQuery):
 
 
 # Обработчик подтверждения удаления
-@dp.callback_query(lambda c: c.data.startswith("confirm_delete_"))
-async def perform_delete_event(callback_query: types.CallbackQuery):
+@callbacks.route("confirm_delete", int)
+async def perform_delete_event(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
 
-    events = load_events()
-    if event_idx >= len(events):
+    event = await get_event(event_id)
+    if event is None:
         await callback_query.message.answer("⚠️ Мероприятие не найдено")
         return
 
-    event = events[event_idx]
-
     # Проверяем, является ли пользователь создателем
     if event.get("creator_id") != user_id:
         await callback_query.message.answer("⚠️ Только создатель мероприятия может удалить его")
         return
 
-    # Запоминаем название мероприятия перед удалением
+    # Запоминаем название и участников мероприятия перед удалением
     event_name = event.get("name", "Мероприятие")
+    participant_ids = await storage.participant_ids(event_id)
 
     # Удаляем мероприятие
-    success = delete_event(event_idx)
+    success = await delete_event(event_id)
 
     if success:
+        await notify_participants(
+            participant_ids,
+            f"❌ Мероприятие «{event_name}», на которое вы записаны, отменено организатором.",
+            except_user_id=user_id
+        )
         await callback_query.message.edit_caption(
             caption=f"✅ Мероприятие \"{event_name}\" успешно удалено",
             reply_markup=get_main_menu(user_id)
@@ -678,111 +1024,79 @@ async def perform_delete_event(callback_query: types.CallbackQuery):
         )
 
 
-# Обработчик для кнопки "Вы создатель этого мероприятия"
-@dp.callback_query(lambda c: c.data.startswith("creator_info_"))
-async def creator_info(callback_query: types.CallbackQuery):
-    await callback_query.answer("Вы являетесь создателем этого мероприятия")
-
-# Функция для удаления мероприятия
-def delete_event(event_idx):
-    events = load_events()
-    users = load_users()
-
-    # Проверяем, что индекс корректный
-    if event_idx >= len(events):
-        return False
-
-    # Удаляем мероприятие из списка мероприятий
-    removed_event = events.pop(event_idx)
-
-    # Удаляем регистрации пользователей на это мероприятие
-    for user_id, user_data in users.items():
-        if "registered_events" in user_data:
-            # Удаляем индекс текущего мероприятия, если он есть
-            if event_idx in user_data["registered_events"]:
-                user_data["registered_events"].remove(event_idx)
-
-            # Корректируем индексы мероприятий, которые идут после удаленного
-            updated_registrations = []
-            for reg_idx in user_data["registered_events"]:
-                if reg_idx > event_idx:
-                    updated_registrations.append(reg_idx - 1)
-                else:
-                    updated_registrations.append(reg_idx)
-
-            user_data["registered_events"] = updated_registrations
-
-    # Сохраняем обновленные данные
-    save_data(EVENTS_FILE, events)
-    save_data(USERS_FILE, users)
+# Обработчик для информационных кнопок без действия (номер страницы и т.п.)
+@callbacks.route("none")
+async def noop_button(callback_query: types.CallbackQuery):
+    await callback_query.answer()
 
-    return True
 
+# Обработчик для кнопки "Вы создатель этого мероприятия"
+@callbacks.route("creator_info", int)
+async def creator_info(callback_query: types.CallbackQuery, event_id: int):
+    await callback_query.answer("Вы являетесь создателем этого мероприятия")
 
-def cancel_user_registration_for_event(user_id, event_idx):
-    users = load_users()
-    if user_id not in users:
-        return False
+# Функция для удаления мероприятия (вместе с регистрациями на него)
+async def delete_event(event_id):
+    deleted = await storage.delete_event(event_id)
+    invalidate_event_caption(event_id)
+    search_index.remove(event_id)
+    reminders.cancel(event_id)
+    return deleted
 
-    if "registered_events" not in users[user_id]:
-        return False
 
-    if event_idx in users[user_id]["registered_events"]:
-        users[user_id]["registered_events"].remove(event_idx)
-        save_data(USERS_FILE, users)
-        return True
-    return False
+async def cancel_user_registration_for_event(user_id, event_id):
+    return await storage.cancel_registration(user_id, event_id)
 
 
-@dp.callback_query(lambda c: c.data.startswith("cancel_registration_"))
-async def cancel_event_registration(callback_query: types.CallbackQuery):
+@callbacks.route("cancel_registration", int)
+async def cancel_event_registration(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
 
-    events = load_events()
-    if event_idx >= len(events):
+    event = await get_event(event_id)
+    if event is None:
         await callback_query.message.answer("⚠️ Мероприятие не найдено")
         return
 
-    event = events[event_idx]
-
     # Проверяем, не является ли пользователь создателем мероприятия
     if event.get("creator_id") == user_id:
         await callback_query.message.answer("⚠️ Создатель мероприятия не может отменить свою регистрацию")
         return
 
-    success = cancel_user_registration_for_event(user_id, event_idx)
+    success = await cancel_user_registration_for_event(user_id, event_id)
 
     if success:
         caption = f"✅ Регистрация на мероприятие \"{event['name']}\" отменена"
     else:
         caption = f"ℹ️ Вы не были зарегистрированы на это мероприятие"
 
-    await callback_query.message.answer_photo(
-        photo=FSInputFile(MENU_IMAGE_PATH),
+    await answer_menu_photo(callback_query.message,
         caption=caption,
         reply_markup=get_main_menu(user_id)
     )
 
 
 # Функция для создания клавиатуры с кнопкой отмены
+@functools.cache
 def get_cancel_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="❌ Отменить создание мероприятия", callback_data="cancel_event_creation")]
     ])
 
 
-@dp.callback_query(lambda c: c.data == "register_event")
+@callbacks.route("register_event")
 async def process_register_event(callback_query: types.CallbackQuery, state: FSMContext):
     uid = str(callback_query.from_user.id)
-    users = load_users()
-    if uid in users:
-        if users[uid].get('active_event_creations', 0) >= 1:
-            await callback_query.answer("⚠️ Вы уже создали 1 мероприятие, нельзя создать больше.")
-            return
-        users[uid]['active_event_creations'] = users[uid].get('active_event_creations', 0) + 1
-        save_user(uid, users[uid])
+    # Проверка лимита и увеличение счётчика выполняются одной командой в очереди записи
+    allowed = await storage.begin_event_creation(uid, 1)
+    if not allowed and await state.get_state() not in EventRegistrationStates:
+        # Счётчик занят, а создания мероприятия не идёт: диалог был брошен и удалён по TTL
+        # (или потерян при перезапуске со старым хранилищем в памяти) — освобождаем место
+        await storage.finish_event_creation(uid)
+        allowed = await storage.begin_event_creation(uid, 1)
+    if not allowed:
+        await callback_query.answer("⚠️ Вы уже создали 1 мероприятие, нельзя создать больше.")
+        return
     await callback_query.answer()
     await callback_query.message.answer("📝 Введите название мероприятия:", reply_markup=get_cancel_keyboard())
     await state.set_state(EventRegistrationStates.name)
@@ -862,24 +1176,20 @@ async def reg_tg_chat(message: types.Message, state: FSMContext):
 
 
 # Обработчик кнопки отмены создания мероприятия
-@dp.callback_query(lambda c: c.data == "cancel_event_creation")
+@callbacks.route("cancel_event_creation")
 async def cancel_event_creation(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer("Создание мероприятия отменено")
     await state.clear()
     uid = str(callback_query.from_user.id)
-    users = load_users()
-    if uid in users:
-        if users[uid].get('active_event_creations', 0)==1:
-            users[uid]['active_event_creations'] = users[uid].get('active_event_creations', 0) - 1
-            save_user(uid, users[uid])
-            await callback_query.answer()
-            await callback_query.message.answer("📝 Введите название мероприятия:", reply_markup=get_cancel_keyboard())
-            await state.set_state(EventRegistrationStates.name)
-            await callback_query.message.answer_photo(
-                photo=FSInputFile(MENU_IMAGE_PATH),
-                caption="❌ Создание мероприятия отменено",
-                reply_markup=get_main_menu(str(callback_query.from_user.id))
-            )
+    if await storage.finish_event_creation(uid):
+        await callback_query.answer()
+        await callback_query.message.answer("📝 Введите название мероприятия:", reply_markup=get_cancel_keyboard())
+        await state.set_state(EventRegistrationStates.name)
+        await answer_menu_photo(callback_query.message,
+            caption="❌ Создание мероприятия отменено",
+            reply_markup=get_main_menu(str(callback_query.from_user.id))
+        )
+@functools.cache
 def get_event_type_keyboard():
     """Создаёт клавиатуру для выбора типа мероприятия"""
     keyboard = []
@@ -891,10 +1201,9 @@ def get_event_type_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
-@dp.callback_query(lambda c: c.data.startswith("event_type_"))
-async def process_event_type(callback_query: types.CallbackQuery, state: FSMContext):
+@callbacks.route("event_type", str, states=EventRegistrationStates.category)
+async def process_event_type(callback_query: types.CallbackQuery, event_type: str, state: FSMContext):
     await callback_query.answer()
-    event_type = callback_query.data.split("_")[2]
     user_id = str(callback_query.from_user.id)
 
     # Проверка валидности типа мероприятия
@@ -913,76 +1222,66 @@ async def process_event_type(callback_query: types.CallbackQuery, state: FSMCont
             if not link.startswith(("https://t.me/", "https://telegram.me/")):
                 event_data[link_key] = f"https://t.me/{link.lstrip('@')}"
 
-    users = load_users()
-    if user_id in users:
+    user = await get_user(user_id)
+    if user:
         # Сохраняем информацию о создателе
         event_data["creator_id"] = user_id
-        event_data["creator_name"] = users[user_id]["name"]
+        event_data["creator_name"] = user["name"]
         event_data["created_at"] = datetime.datetime.now().isoformat()
 
-    save_event(event_data)
+    await save_event(event_data)
 
-    await callback_query.message.answer_photo(
-        photo=FSInputFile(MENU_IMAGE_PATH),
+    await answer_menu_photo(callback_query.message,
         caption="✅ Мероприятие успешно зарегистрировано!",
         reply_markup=get_main_menu(user_id)
     )
     uid = str(callback_query.from_user.id)
-    users = load_users()
-    if uid in users:
-        if users[uid].get('active_event_creations', 0) == 1:
-            users[uid]['active_event_creations'] = users[uid].get('active_event_creations', 0) - 1
-            save_user(uid, users[uid])
+    await storage.finish_event_creation(uid)
     await state.clear()
 
 
-@dp.callback_query(lambda c: c.data.startswith("register_for_event_"))
-async def register_for_event(callback_query: types.CallbackQuery):
+@callbacks.route("register_for_event", int)
+async def register_for_event(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[3])
     user_id = str(callback_query.from_user.id)
 
-    try:
-        events = load_events()
-        event = events[event_idx]
-
-        # Проверка, не является ли пользователь создателем мероприятия
-        if event.get("creator_id") == user_id:
-            await callback_query.message.answer_photo(
-                photo=FSInputFile(MENU_IMAGE_PATH),
-                caption=f"ℹ️ Вы являетесь создателем этого мероприятия и автоматически зарегистрированы на него.",
-                reply_markup=get_main_menu(user_id)
-            )
-            return
-
-        success = register_user_for_event(user_id, event_idx)
-
-        if success:
-            # Формируем текст с ссылками
-            links_text = ""
-            for link_type, prefix in [("tg_link", "🔗 Telegram канал"),
-                                      ("tg_chat_link", "💬 Telegram чат")]:
-                if link := event.get(link_type):
-                    links_text += f"\n\n{prefix}: {link}"
-
-            caption = f"✅ Вы успешно зарегистрировались на мероприятие \"{event['name']}\"!{links_text}"
-        else:
-            caption = f"ℹ️ Вы уже зарегистрированы на это мероприятие"
-
-        await callback_query.message.answer_photo(
-            photo=FSInputFile(MENU_IMAGE_PATH),
-            caption=caption,
+    event = await get_event(event_id)
+    if event is None:
+        await answer_menu_photo(callback_query.message,
+            caption="⚠️ Мероприятие не найдено",
             reply_markup=get_main_menu(user_id)
         )
-    except (IndexError, KeyError):
-        await callback_query.message.answer_photo(
-            photo=FSInputFile(MENU_IMAGE_PATH),
-            caption="⚠️ Мероприятие не найдено",
+        return
+
+    # Проверка, не является ли пользователь создателем мероприятия
+    if event.get("creator_id") == user_id:
+        await answer_menu_photo(callback_query.message,
+            caption=f"ℹ️ Вы являетесь создателем этого мероприятия и автоматически зарегистрированы на него.",
             reply_markup=get_main_menu(user_id)
         )
+        return
 
+    success = await register_user_for_event(user_id, event_id)
 
-@dp.callback_query(lambda c: c.data == "back_to_main")
+    if success:
+        # Формируем текст с ссылками
+        links_text = ""
+        for link_type, prefix in [("tg_link", "🔗 Telegram канал"),
+                                  ("tg_chat_link", "💬 Telegram чат")]:
+            if link := event.get(link_type):
+                links_text += f"\n\n{prefix}: {link}"
+
+        caption = f"✅ Вы успешно зарегистрировались на мероприятие \"{event['name']}\"!{links_text}"
+    else:
+        caption = f"ℹ️ Вы уже зарегистрированы на это мероприятие"
+
+    await answer_menu_photo(callback_query.message,
+        caption=caption,
+        reply_markup=get_main_menu(user_id)
+    )
+
+
+@callbacks.route("back_to_main")
 async def back_to_main(callback_query: types.CallbackQuery):
     await callback_query.answer()
     user_id = str(callback_query.from_user.id)
@@ -992,7 +1291,7 @@ async def back_to_main(callback_query: types.CallbackQuery):
     )
 
 
-@dp.callback_query(lambda c: c.data == "back_to_categories")
+@callbacks.route("back_to_categories")
 async def back_to_categories(callback_query: types.CallbackQuery):
     await callback_query.answer()
     await callback_query.message.edit_caption(
@@ -1001,7 +1300,7 @@ async def back_to_categories(callback_query: types.CallbackQuery):
     )
 
 
-@dp.callback_query(lambda c: c.data == "back_to_events")
+@callbacks.route("back_to_events")
 async def back_to_events(callback_query: types.CallbackQuery):
     await callback_query.answer()
     await callback_query.message.edit_caption(
@@ -1010,10 +1309,9 @@ async def back_to_events(callback_query: types.CallbackQuery):
     )
 
 
-@dp.callback_query(lambda c: c.data.startswith("category_"))
-async def process_category_selection(callback_query: types.CallbackQuery):
+@callbacks.route("category", str)
+async def process_category_selection(callback_query: types.CallbackQuery, category: str):
     await callback_query.answer()
-    category = callback_query.data.split("_")[1]
 
     category_names = {
         "party": "Тусовки",
@@ -1035,13 +1333,17 @@ async def process_category_selection(callback_query: types.CallbackQuery):
         "other": "🔍"
     }
 
+    if category in DATE_LISTS:
+        caption = f"{DATE_LISTS[category]['emoji']} {DATE_LISTS[category]['name']}:"
+    else:
+        caption = f"{category_emojis.get(category, '')} Мероприятия категории «{category_names.get(category, category)}»"
     await callback_query.message.edit_caption(
-        caption=f"{category_emojis.get(category, '')} Мероприятия категории «{category_names.get(category, category)}»",
-        reply_markup=get_events_list(category, 0)
+        caption=caption,
+        reply_markup=await get_events_list(category, 0)
     )
 
 
-@dp.callback_query(lambda c: c.data == "view_events")
+@callbacks.route("view_events")
 async def view_events(callback_query: types.CallbackQuery):
     await callback_query.answer()
     await callback_query.message.edit_caption(
@@ -1050,68 +1352,35 @@ async def view_events(callback_query: types.CallbackQuery):
     )
 
 
-@dp.callback_query(lambda c: c.data == "my_events")
+@callbacks.route("my_events")
 async def my_events(callback_query: types.CallbackQuery):
     await callback_query.answer()
     user_id = str(callback_query.from_user.id)
     await callback_query.message.edit_caption(
         caption="📅 Мои мероприятия:",
-        reply_markup=get_my_events_list(user_id, 0)
+        reply_markup=await get_my_events_list(user_id, 0)
     )
 
 
-@dp.callback_query(lambda c: c.data.startswith("my_event_"))
-async def view_my_event(callback_query: types.CallbackQuery):
-    await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
-    user_id = str(callback_query.from_user.id)
-
-    events = load_events()
-    if event_idx >= len(events):
-        await callback_query.message.answer("⚠️ Мероприятие не найдено")
-        return
-
-    event = events[event_idx]
-    is_creator = event.get("creator_id") == user_id
-
-    # Формируем текст мероприятия
-    caption = format_event_caption(event, show_creator=False)
-
-    # Кнопка редактирования показывается только создателю
-    buttons = []
-    if is_creator:
-        buttons.append([InlineKeyboardButton(text="✏️ Редактировать мероприятие",
-                                             callback_data=f"edit_event_{event_idx}")])
-
-    buttons.append([InlineKeyboardButton(text="⬅️ Назад к моим мероприятиям",
-                                         callback_data="my_events")])
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-
-    await callback_query.message.edit_caption(caption=caption, reply_markup=keyboard)
-
-
 # Начало процесса редактирования
-@dp.callback_query(lambda c: c.data.startswith("edit_event_"))
-async def start_edit_event(callback_query: types.CallbackQuery, state: FSMContext):
+@callbacks.route("edit_event", int)
+async def start_edit_event(callback_query: types.CallbackQuery, event_id: int, state: FSMContext):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
 
-    events = load_events()
-    if event_idx >= len(events):
+    event = await get_event(event_id)
+    if event is None:
         await callback_query.message.answer("⚠️ Мероприятие не найдено")
         return
 
-    event = events[event_idx]
-
     # Проверяем, является ли пользователь создателем
     if event.get("creator_id") != user_id:
         await callback_query.message.answer("⚠️ Вы не являетесь создателем этого мероприятия")
         return
 
     # Сохраняем индекс мероприятия и текущие данные
-    await state.update_data(event_idx=event_idx, original_event=event)
+    # Версия нужна, чтобы не применить правки поверх чужого изменения или удаления
+    await state.update_data(event_id=event_id, event_version=event.get("version"), original_event=dict(event))
     await state.set_state(EventEditStates.name)
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -1125,67 +1394,60 @@ async def start_edit_event(callback_query: types.CallbackQuery, state: FSMContex
 
 
 # Функция для получения списка зарегистрированных пользователей на мероприятие
-def get_registered_users_for_event(event_idx):
-    users = load_users()
-    registered_users = []
+async def get_registered_users_for_event(event_id, limit=None):
+    return await storage.participants(event_id, limit)
 
-    for user_id, user_data in users.items():
-        if "registered_events" in user_data and event_idx in user_data["registered_events"]:
-            registered_users.append({
-                "id": user_id,
-                "name": user_data.get("name", "Пользователь"),
-                "faculty": user_data.get("faculty", "")
-            })
 
-    return registered_users
+async def get_participants_count(event_id):
+    return await storage.participants_count(event_id)
 
 
 # Обработчик для просмотра списка участников
-@dp.callback_query(lambda c: c.data.startswith("view_participants_"))
-async def view_event_participants(callback_query: types.CallbackQuery):
+@callbacks.route("view_participants", int)
+async def view_event_participants(callback_query: types.CallbackQuery, event_id: int):
     await callback_query.answer()
-    event_idx = int(callback_query.data.split("_")[2])
     user_id = str(callback_query.from_user.id)
 
-    events = load_events()
-    if event_idx >= len(events):
+    event = await get_event(event_id)
+    if event is None:
         await callback_query.message.answer("⚠️ Мероприятие не найдено")
         return
 
-    event = events[event_idx]
-
     # Проверяем, является ли пользователь создателем
     if event.get("creator_id") != user_id:
         await callback_query.message.answer("⚠️ Только создатель мероприятия может просматривать список участников")
         return
 
     # Получаем список зарегистрированных пользователей
-    registered_users = get_registered_users_for_event(event_idx)
+    # Подпись к фото ограничена Telegram, поэтому показываем только первых участников
+    participants_count = await get_participants_count(event_id)
+    registered_users = await get_registered_users_for_event(event_id, limit=PARTICIPANTS_SHOWN)
 
     # Формируем текст сообщения
     event_name = event.get("name", "Мероприятие")
     if registered_users:
         participants_text = "\n".join([f"{i + 1}. {user['name']} ({user['faculty']})"
                                        for i, user in enumerate(registered_users)])
-        caption = f"👥 Участники мероприятия \"{event_name}\" ({len(registered_users)}):\n\n{participants_text}"
+        if participants_count > len(registered_users):
+            participants_text += f"\n… и ещё {participants_count - len(registered_users)}"
+        caption = f"👥 Участники мероприятия \"{event_name}\" ({participants_count}):\n\n{participants_text}"
     else:
         caption = f"👥 На мероприятие \"{event_name}\" пока никто не зарегистрировался"
 
     # Кнопка возврата к мероприятию
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад к мероприятию", callback_data=f"my_event_{event_idx}")],
+        [InlineKeyboardButton(text="⬅️ Назад к мероприятию", callback_data=f"my_event_{event_id}")],
         [InlineKeyboardButton(text="🏠 Назад в меню", callback_data="back_to_main")]
     ])
 
-    await callback_query.message.answer_photo(
-        photo=FSInputFile(MENU_IMAGE_PATH),
+    await answer_menu_photo(callback_query.message,
         caption=caption,
         reply_markup=keyboard
     )
 
 
 # Обработчик для сохранения текущего значения
-@dp.callback_query(lambda c: c.data == "keep_current")
+@callbacks.route("keep_current")
 async def keep_current_value(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
     current_state = await state.get_state()
@@ -1278,7 +1540,7 @@ async def keep_current_value(callback_query: types.CallbackQuery, state: FSMCont
 
 
 # Обработчик для сохранения текущей категории
-@dp.callback_query(lambda c: c.data == "keep_category")
+@callbacks.route("keep_category")
 async def keep_current_category(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
     data = await state.get_data()
@@ -1407,10 +1669,9 @@ async def process_edit_tg_chat_link(message: types.Message, state: FSMContext):
 
 
 # Обработчик выбора категории при редактировании
-@dp.callback_query(lambda c: c.data.startswith("event_type_") and EventEditStates.category)
-async def process_edit_category(callback_query: types.CallbackQuery, state: FSMContext):
+@callbacks.route("event_type", str, states=EventEditStates.category)
+async def process_edit_category(callback_query: types.CallbackQuery, event_type: str, state: FSMContext):
     await callback_query.answer()
-    event_type = callback_query.data.split("_")[2]
 
     # Проверка валидности типа мероприятия
     if event_type not in EVENT_TYPES:
@@ -1426,26 +1687,36 @@ async def process_edit_category(callback_query: types.CallbackQuery, state: FSMC
 # Функция завершения редактирования
 async def complete_edit(callback_query: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    event_idx = data.get("event_idx")
-    original_event = data.get("original_event", {})
-
-    # Обновляем данные мероприятия
-    events = load_events()
-
-    if event_idx < len(events):
-        # Сохраняем обновленные поля
-        for field in ["name", "description", "location", "time", "tg_link", "tg_chat_link", "category"]:
-            if field in data:
-                events[event_idx][field] = data[field]
+    event_id = data.get("event_id")
 
-        # Обновляем время редактирования
-        events[event_idx]["edited_at"] = datetime.datetime.now().isoformat()
+    # Обновляемые поля мероприятия
+    fields = {field: data[field]
+              for field in ["name", "description", "location", "time", "tg_link", "tg_chat_link", "category"]
+              if field in data}
+    # Обновляем время редактирования
+    fields["edited_at"] = datetime.datetime.now().isoformat()
 
-        # Сохраняем изменения
-        save_data(EVENTS_FILE, events)
+    try:
+        updated = event_id is not None and await update_event(event_id, fields, data.get("event_version"))
+        if updated:
+            invalidate_event_caption(event_id)
+    except StaleVersionError:
+        await callback_query.message.answer(
+            "⚠️ Мероприятие было изменено, пока вы его редактировали. Начните редактирование заново."
+        )
+        await state.clear()
+        return
 
-        await callback_query.message.answer_photo(
-            photo=FSInputFile(MENU_IMAGE_PATH),
+    if updated:
+        event = await get_event(event_id)
+        if event is not None:
+            await notify_participants(
+                await storage.participant_ids(event_id),
+                f"✏️ Мероприятие «{event['name']}», на которое вы записаны, изменилось. "
+                f"Подробности — в разделе «📅 Мои мероприятия».",
+                except_user_id=str(callback_query.from_user.id)
+            )
+        await answer_menu_photo(callback_query.message,
             caption="✅ Мероприятие успешно обновлено!",
             reply_markup=get_main_menu(str(callback_query.from_user.id))
         )
@@ -1457,8 +1728,40 @@ async def complete_edit(callback_query: types.CallbackQuery, state: FSMContext):
 
 
 async def main():
-    ensure_files_exist()
-    await dp.start_polling(bot)
+    media_cache.load()
+    await storage.load()
+    storage.start()
+    await build_search_index()
+    await ai_answer_cache.load(await catalog_fingerprint(), ai_cache_version())
+    await reminders.rebuild(await load_events())
+    reminders.start()
+    archiver = asyncio.create_task(archive_past_events())
+    purger = asyncio.create_task(purge_abandoned_states())
+    notifications.start()
+    ai_client.start()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, url=WEBHOOK_URL,
+                              secret_token=WEBHOOK_SECRET, drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        archiver.cancel()
+        purger.cancel()
+        await reminders.close()
+        await notifications.close()
+        await ai_client.close()
+        await ai_answer_cache.save(await catalog_fingerprint(), ai_cache_version())
+        await storage.close()
+        # В режиме polling хранилище состояний уже закрыл диспетчер; повторное закрытие ничего не делает
+        await fsm_storage.close()
+        await send_scheduler.close()
+        logging.info(f"Исходящие запросы: {send_scheduler.stats()}")
+        logging.info(f"Кэш клавиатур: {keyboard_cache.stats()}")
+        logging.info(f"Кэш подписей: {caption_cache.stats()}")
+        logging.info(f"Кэш ответов AI: {ai_answer_cache.stats()}")
+        if hasattr(fsm_storage, "stats"):
+            logging.info(f"Кэш состояний диалогов: {fsm_storage.stats()}")
 
 
 if __name__ == '__main__':
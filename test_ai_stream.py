@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import time
+
+from aiohttp.test_utils import TestServer
+
+import fake_ai
+from ai_client import AIClient
+from progressive_reply import CURSOR, ProgressiveReply
+
+PROMPT = "МЕРОПРИЯТИЯ, ИЗ КОТОРЫХ МОЖНО СОВЕТОВАТЬ:\nНазвание: Квиз\n\nUser: куда сходить?"
+WORDS = 40
+# Ответ генерируется около секунды: 40 слов по 40 в секунду после 0.1 с ожидания
+FAKE_AI_ARGS = argparse.Namespace(first_token=0.1, tokens_per_second=40, words=WORDS)
+EDIT_INTERVAL = 0.3
+
+
+class FakeMessage:
+    """Сообщение бота, запоминающее свои правки и отправленные продолжения."""
+
+    def __init__(self):
+        self.text = "💬 Думаю..."
+        self.edits = []
+        self.answers = []
+
+    async def edit_text(self, text):
+        self.edits.append((time.monotonic(), text))
+        self.text = text
+
+    async def answer(self, text):
+        self.answers.append(text)
+
+
+async def with_fake_ai(scenario):
+    server = TestServer(fake_ai.make_app(FAKE_AI_ARGS))
+    await server.start_server()
+    client = AIClient(str(server.make_url("/ai")), {})
+    client.start()
+    try:
+        return await scenario(client)
+    finally:
+        await client.close()
+        await server.close()
+
+
+def expected_answer():
+    return "".join(fake_ai.make_answer(PROMPT, WORDS))
+
+
+def test_stream_parses_sse_deltas():
+    async def scenario(client):
+        return [chunk async for chunk in client.stream({"value": PROMPT, "stream": True})]
+
+    chunks = asyncio.run(with_fake_ai(scenario))
+    assert len(chunks) == WORDS
+    assert "".join(chunks) == expected_answer()
+    assert "«Квиз»" in chunks[3]
+
+
+def test_stream_falls_back_to_single_chunk_for_plain_json():
+    async def scenario(client):
+        return [chunk async for chunk in client.stream({"value": PROMPT})]
+
+    chunks = asyncio.run(with_fake_ai(scenario))
+    assert chunks == [expected_answer().strip()]
+
+
+def test_progressive_reply_throttles_edits_and_finishes():
+    async def scenario(client):
+        message = FakeMessage()
+        reply = ProgressiveReply(message, EDIT_INTERVAL, prefix="🤖 ")
+        text = ""
+        started = time.monotonic()
+        async for chunk in client.stream({"value": PROMPT, "stream": True}):
+            text += chunk
+            await reply.update(text)
+        await reply.finish()
+        return message, reply, time.monotonic() - started
+
+    message, reply, elapsed = asyncio.run(with_fake_ai(scenario))
+    *progress, (_, final) = message.edits
+    # Промежуточные правки — не чаще раза в интервал и с курсором
+    assert progress
+    for (previous, _), (current, _) in zip(progress, progress[1:]):
+        assert current - previous >= EDIT_INTERVAL
+    assert all(text.endswith(CURSOR) for _, text in progress)
+    assert len(progress) <= elapsed / EDIT_INTERVAL + 1
+    # Окончательная правка — всегда, с полным текстом и без курсора
+    assert final == f"🤖 {expected_answer()}"
+    assert reply.edits == len(message.edits)
+    assert message.answers == []
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import signal
+import socket
+
+import aiohttp
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import fake_telegram
+from fake_telegram import make_update
+from webhook import DrainingRequestHandler, run_webhook
+
+TOKEN = "123456:ABCdef"
+SECRET = "secret"
+# Столько обрабатывается каждый апдейт: SIGTERM приходит, пока все они ещё в работе
+HANDLE_DELAY = 0.3
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_fake_api():
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", fake_telegram.handle_api)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def make_dispatcher():
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: types.Message, bot: Bot):
+        await asyncio.sleep(HANDLE_DELAY)
+        await bot.send_message(message.chat.id, message.text)
+
+    return dp
+
+
+def make_bot(api):
+    return Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(str(api.make_url("")))))
+
+
+def test_webhook_checks_secret_and_drains_on_sigterm():
+    async def scenario():
+        fake_telegram.api_calls.clear()
+        api = await start_fake_api()
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/webhook"
+        server = asyncio.create_task(run_webhook(make_dispatcher(), make_bot(api), "127.0.0.1", port,
+                                                 "/webhook", secret_token=SECRET, drain_timeout=10))
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(50):
+                    try:
+                        async with session.post(url, json=make_update(1, 1, "ping")) as response:
+                            wrong_secret = response.status
+                        break
+                    except aiohttp.ClientConnectionError:
+                        await asyncio.sleep(0.1)
+                assert wrong_secret == 401
+
+                headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+                statuses = []
+                for update_id in range(2, 22):
+                    async with session.post(url, json=make_update(update_id, update_id, "ping"),
+                                            headers=headers) as response:
+                        statuses.append(response.status)
+                assert statuses == [200] * 20
+                assert fake_telegram.api_calls["sendMessage"] == 0
+
+            # Обработчики сигналов run_webhook ставит до первого ответа вебхука
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(server, timeout=10)
+            assert fake_telegram.api_calls["sendMessage"] == 20
+        finally:
+            server.cancel()
+            await api.close()
+
+    asyncio.run(scenario())
+
+
+def test_webhook_answers_503_while_draining():
+    async def scenario():
+        api = await start_fake_api()
+        bot = make_bot(api)
+        handler = DrainingRequestHandler(make_dispatcher(), bot, secret_token=SECRET, drain_timeout=10)
+        app = web.Application()
+        handler.register(app, path="/webhook")
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/webhook", json=make_update(1, 1, "ping"), headers=headers)
+            assert response.status == 200
+
+            # Пока принятый апдейт дообрабатывается, новые получают 503
+            closing = asyncio.create_task(handler.close())
+            await asyncio.sleep(0)
+            response = await client.post("/webhook", json=make_update(2, 2, "ping"), headers=headers)
+            assert response.status == 503
+            assert not closing.done()
+            await closing
+        await api.close()
+
+    asyncio.run(scenario())
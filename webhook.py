@@ -0,0 +1,66 @@
+import asyncio
+import contextlib
+import logging
+import signal
+
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука: сразу отвечает Telegram 200, а апдейт обрабатывает в фоне."""
+
+    def __init__(self, dispatcher, bot, secret_token=None, drain_timeout=30.0, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.drain_timeout = drain_timeout
+        self._draining = False
+
+    async def handle(self, request):
+        # Во время остановки Telegram доставит апдейт повторно после перезапуска
+        if self._draining:
+            return web.Response(status=503, text="Shutting down")
+        return await super().handle(request)
+
+    __call__ = handle
+
+    async def close(self):
+        self._draining = True
+        # Принятые апдейты дообрабатываются не дольше drain_timeout, потом закрывается сессия бота
+        in_flight = set(self._background_feed_update_tasks)
+        if in_flight:
+            logging.info(f"Ожидание обработки принятых апдейтов: {len(in_flight)}")
+            _, pending = await asyncio.wait(in_flight, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.warning(f"Не дождались обработки апдейтов: {len(pending)}")
+        await super().close()
+
+
+async def run_webhook(dispatcher, bot, host, port, path, url=None, secret_token=None, drain_timeout=30.0):
+    """Поднимает aiohttp сервер вебхука и работает до SIGINT/SIGTERM.
+
+    Если задан url, вебхук регистрируется в Telegram на url + path; иначе считается, что
+    он уже настроен (например, за обратным прокси).
+    """
+    handler = DrainingRequestHandler(dispatcher, bot, secret_token=secret_token, drain_timeout=drain_timeout)
+    app = web.Application()
+    handler.register(app, path=path)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"Вебхук слушает {host}:{port}{path}")
+    try:
+        if url:
+            await bot.set_webhook(f"{url.rstrip('/')}{path}", secret_token=secret_token,
+                                  allowed_updates=dispatcher.resolve_used_update_types())
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+    finally:
+        # Сначала закрывается порт, затем on_shutdown дожидается принятых апдейтов
+        await runner.cleanup()